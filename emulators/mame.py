@@ -15,7 +15,7 @@ LOG_FORMAT = logging.Formatter("[{}] [%(levelname)s] [%(name)s] : %(message)s".f
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-file_handler = logging.FileHandler(LOG_FILE)
+file_handler = logging.FileHandler(LOG_FILE, delay=True)
 file_handler.setLevel(logging.DEBUG)
 file_handler.setFormatter(LOG_FORMAT)
 
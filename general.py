@@ -1,15 +1,25 @@
 import os
+import io
 import shutil
 import configparser
 import time
 import zipfile
 import logging
 import subprocess
-import binascii
+import sqlite3
+import json
+import threading
+import types
+import concurrent.futures
+import hashlib
+import shlex
+import zlib
+import lzma
 import xml.etree.cElementTree as ET
 from xml.dom import minidom
 
-import rarfile
+import sevenzip
+import ziptools
 
 LOG_FILE = "arcade.log"
 LOG_STAMP = time.strftime("%Y-%m-%d %H:%M:%S")
@@ -18,7 +28,7 @@ LOG_FORMAT = logging.Formatter("[{}] [%(levelname)s] [%(name)s] : %(message)s".f
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-file_handler = logging.FileHandler(LOG_FILE)
+file_handler = logging.FileHandler(LOG_FILE, delay=True)
 file_handler.setLevel(logging.DEBUG)
 file_handler.setFormatter(LOG_FORMAT)
 
@@ -30,6 +40,114 @@ stream_handler.setFormatter(LOG_FORMAT)
 logger.addHandler(stream_handler)
 
 
+def _read_paths_ini():
+    """
+    "_read_paths_ini" reads every path from the settings/paths.ini file
+
+    Args:
+        None
+
+    Returns:
+        read only Dictionary of the Paths attribute names and values
+
+    Raises:
+        None
+    """
+    ini = os.path.join(os.path.dirname(__file__), "Settings", "paths.ini")
+    config = configparser.ConfigParser(interpolation=configparser.ExtendedInterpolation())
+    config.optionxform = str
+    config.read(ini)
+
+    paths = {}
+
+    paths["root_drive"] = config.get("Common", "root_drive")
+    paths["root_path"] = config.get("Common", "root_path")
+
+    paths["emulator_path"] = config.get("Arcade", "emulator_path")
+    paths["rom_path"] = config.get("Arcade", "roms_path")
+    paths["log_path"] = config.get("Arcade", "logs_path")
+    paths["temp_path"] = config.get("Arcade", "temp_path")
+    paths["store_path"] = config.get("Arcade", "store_path")
+    paths["staging_path"] = config.get("Arcade", "staging_path")
+    paths["staging_budget"] = int(config.get("Arcade", "staging_budget")) * 1024 * 1024
+    paths["utilities_path"] = config.get("Arcade", "utilities_path")
+    paths["frontends_path"] = config.get("Arcade", "frontends_path")
+
+    paths["mstr_no_intro"] = config.get("Master ROMs", "NoIntro")
+    paths["mstr_mame"] = config.get("Master ROMs", "MAME")
+    paths["mstr_sl"] = config.get("Master ROMs", "SoftwareList")
+    paths["mstr_good_set"] = config.get("Master ROMs", "GoodSet")
+    paths["mstr_non_good_set"] = config.get("Master ROMs", "NonGoodSet")
+    paths["mstr_redump"] = config.get("Master ROMs", "Redump")
+    paths["mstr_tosec"] = config.get("Master ROMs", "TOSEC")
+
+    paths["emu_movies_path"] = config.get("EmuMovies", "DownloadPath")
+
+    paths["seven_zip_exe"] = config.get("Compressor", "SevenZip")
+    paths["rar_exe"] = config.get("Compressor", "Rar")
+    paths["crc_catalog"] = config.get("Compressor", "Catalog")
+    paths["compress_threads"] = int(config.get("Compressor", "Threads"))
+
+    paths["rl_path"] = config.get("RocketLauncher", "path")
+    # Front Ends
+    paths["hs_path"] = config.get("FrontEnds", "HyperSpin")
+    # Utilities
+    paths["notepad"] = config.get("Utilities", "Notepad++")
+    paths["clrmamepro"] = config.get("Utilities", "clrmamepro")
+    # Archives
+    paths["rocket_launcher_archive"] = config.get("Installs", "RocketLauncher")
+    paths["rocket_launcher_media_archive"] = config.get("Installs", "RocketLauncher_Media")
+    paths["hyperspin_archive"] = config.get("Installs", "HyperSpin")
+    paths["hyperspin_upgrade_archive"] = config.get("Installs", "HyperSpin_Upgrade")
+
+    return types.MappingProxyType(paths)
+
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def get_config():
+    """
+    "get_config" returns the settings from paths.ini, the file is only read the first time so every Paths
+    object in the process shares one read only copy
+
+    Args:
+        None
+
+    Returns:
+        read only Dictionary of the Paths attribute names and values
+
+    Raises:
+        None
+    """
+    global _config
+    with _config_lock:
+        if _config is None:
+            _config = _read_paths_ini()
+        return _config
+
+
+def reload_config():
+    """
+    "reload_config" reads paths.ini again, objects created from then on get the new settings, objects that
+    already exist keep the ones they were created with
+
+    Args:
+        None
+
+    Returns:
+        read only Dictionary of the Paths attribute names and values
+
+    Raises:
+        None
+    """
+    global _config
+    with _config_lock:
+        _config = _read_paths_ini()
+        return _config
+
+
 class Paths:
 
     def __init__(self):
@@ -39,7 +157,7 @@ class Paths:
     def _load_paths(self):
         """
         "load_paths" is a method that will set all the paths for the system based on the
-        settings/paths.ini file
+        settings/paths.ini file, the file is parsed once per process, see "get_config"
 
         Args:
             self
@@ -50,45 +168,365 @@ class Paths:
         Raises:
             None
         """
-        ini = os.path.join(os.path.dirname(__file__), "Settings", "paths.ini")
-        config = configparser.ConfigParser(interpolation=configparser.ExtendedInterpolation())
-        config.optionxform = str
-        config.read(ini)
+        self.__dict__.update(get_config())
+
+
+CATALOG_VERSION = 3
+
+
+class CrcCatalog:
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(os.path.dirname(self.db_file)):
+            os.makedirs(os.path.dirname(self.db_file))
+        self._conn = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS files ("
+                           "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, crcs TEXT)")
+        # Entries written by an older version are missing info, e.g. nested archives
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < CATALOG_VERSION:
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("PRAGMA user_version = {}".format(CATALOG_VERSION))
+        self._conn.commit()
+
+    @staticmethod
+    def _stat(src_file):
+        stat = os.stat(src_file)
+        if os.path.splitext(src_file)[1].lower() not in DISC_SHEETS:
+            return stat.st_size, stat.st_mtime_ns
+        # A disc is hashed through its sheet, so a changed track has to change the key too
+        size = stat.st_size
+        stats = [(src_file, stat.st_size, stat.st_mtime_ns)]
+        for track in parse_disc_sheet(src_file):
+            track_stat = os.stat(track)
+            size += track_stat.st_size
+            stats.append((track, track_stat.st_size, track_stat.st_mtime_ns))
+        return size, int(hashlib.sha1(repr(stats).encode("utf-8")).hexdigest()[:15], 16)
+
+    def lookup(self, src_file):
+        """
+        "lookup" is a method that returns the cached CRC info for a file if the file has not
+        changed since it was catalogued
+
+        Args:
+            src_file(required): full path of the file
+
+        Returns:
+            List of Dictionaries that have the filename and crc values, None if not catalogued
+
+        Raises:
+            None
+        """
+        try:
+            size, mtime = self._stat(src_file)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime, crcs FROM files WHERE path = ?",
+                                     (os.path.abspath(src_file),)).fetchone()
+        if row and row[0] == size and row[1] == mtime:
+            return json.loads(row[2])
+        return None
+
+    def store(self, src_file, crcs):
+        """
+        "store" is a method that saves the CRC info for a file, keyed by path, size and modified time
 
-        self.root_drive = config.get("Common", "root_drive")
-        self.root_path = config.get("Common", "root_path")
+        Args:
+            src_file(required): full path of the file
+            crcs(required): List of Dictionaries that have the filename and crc values
 
-        self.emulator_path = config.get("Arcade", "emulator_path")
-        self.rom_path = config.get("Arcade", "roms_path")
-        self.log_path = config.get("Arcade", "logs_path")
-        self.temp_path = config.get("Arcade", "temp_path")
-        self.utilities_path = config.get("Arcade", "utilities_path")
-        self.frontends_path = config.get("Arcade", "frontends_path")
+        Returns:
+            None
 
-        self.mstr_no_intro = config.get("Master ROMs", "NoIntro")
-        self.mstr_mame = config.get("Master ROMs", "MAME")
-        self.mstr_sl = config.get("Master ROMs", "SoftwareList")
-        self.mstr_good_set = config.get("Master ROMs", "GoodSet")
-        self.mstr_non_good_set = config.get("Master ROMs", "NonGoodSet")
-        self.mstr_redump = config.get("Master ROMs", "Redump")
-        self.mstr_tosec = config.get("Master ROMs", "TOSEC")
+        Raises:
+            None
+        """
+        size, mtime = self._stat(src_file)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO files (path, size, mtime, crcs) VALUES (?, ?, ?, ?)",
+                               (os.path.abspath(src_file), size, mtime, json.dumps(crcs)))
+            self._conn.commit()
 
-        self.emu_movies_path = config.get("EmuMovies", "DownloadPath")
+    def purge(self):
+        """
+        "purge" is a method that removes entries for files that no longer exist
 
-        self.seven_zip_exe = config.get("Compressor", "SevenZip")
-        self.rar_exe = config.get("Compressor", "Rar")
+        Args:
+            self
+
+        Returns:
+            Number of entries removed
+
+        Raises:
+            None
+        """
+        with self._lock:
+            paths = [row[0] for row in self._conn.execute("SELECT path FROM files")]
+            missing = [(path,) for path in paths if not os.path.isfile(path)]
+            self._conn.executemany("DELETE FROM files WHERE path = ?", missing)
+            self._conn.commit()
+        return len(missing)
+
+
+_catalogs = {}
+
+HASH_CHUNK_SIZE = 1024 * 1024
+SEVEN_ZIP_MAX_ARGS = 8000
+
+# Archives inside archives are read in memory, up to this size and depth
+NESTED_EXTENSIONS = (".zip", ".7z")
+NESTED_MAX_SIZE = 256 * 1024 * 1024
+NESTED_MAX_DEPTH = 3
+
+# Disc image sheets, their track files are hashed in parallel
+DISC_SHEETS = (".cue", ".gdi")
+
+# TorrentZip style settings for reproducible zips
+DETERMINISTIC_DATE_TIME = (1996, 12, 24, 23, 32, 0)
+DETERMINISTIC_LEVEL = 9
+
+# Single files at least this large are deflated on several threads at once
+PARALLEL_DEFLATE_MIN_SIZE = 64 * 1024 * 1024
+
+
+def get_catalog(db_file):
+    """
+    "get_catalog" returns the shared CrcCatalog for the database file, one connection per process
+
+    Args:
+        db_file(required): path of the SQLite catalog
+
+    Returns:
+        CrcCatalog
+
+    Raises:
+        None
+    """
+    if db_file not in _catalogs:
+        _catalogs[db_file] = CrcCatalog(db_file)
+    return _catalogs[db_file]
+
+
+def hash_file(src_file, chunk_size=HASH_CHUNK_SIZE):
+    """
+    "hash_file" calculates the CRC-32, MD5 and SHA1 of a file in a single read pass, reading
+    the file in fixed size chunks so memory use does not grow with the file size
+
+    Args:
+        src_file(required): full path of the file to hash
+        chunk_size(optional, default=1 MiB): size of each read
+
+    Returns:
+        Dictionary with the size, crc, md5 and sha1 values
+
+    Raises:
+        None
+    """
+    crc = 0
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    size = 0
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with open(src_file, "rb") as f:
+        while True:
+            length = f.readinto(buf)
+            if not length:
+                break
+            chunk = view[:length]
+            crc = zlib.crc32(chunk, crc)
+            md5.update(chunk)
+            sha1.update(chunk)
+            size += length
+
+    return {"size": size,
+            "crc": "%08X" % (crc & 0xFFFFFFFF),
+            "md5": md5.hexdigest(),
+            "sha1": sha1.hexdigest()}
+
+
+def parse_disc_sheet(sheet):
+    """
+    "parse_disc_sheet" reads a CUE or GDI sheet and returns the track files it points to
+
+    Args:
+        sheet(required): full path of the .cue or .gdi file
+
+    Returns:
+        list of full paths of the track files, in sheet order
+
+    Raises:
+        None
+    """
+    folder = os.path.dirname(sheet)
+    ext = os.path.splitext(sheet)[1].lower()
+    with open(sheet, mode="r", errors="replace") as f:
+        lines = [line.strip() for line in f.read().splitlines()]
+
+    names = []
+    if ext == ".cue":
+        # FILE "Game (Track 01).bin" BINARY
+        for line in lines:
+            if line.upper().startswith("FILE "):
+                name = line[5:].strip()
+                if name.startswith('"'):
+                    name = name[1:name.index('"', 1)]
+                else:
+                    name = name.rsplit(" ", 1)[0]
+                names.append(name)
+    else:
+        # 1 0 4 2352 "track01.bin" 0
+        for line in lines[1:]:
+            try:
+                parts = shlex.split(line)
+            except ValueError:
+                continue
+            if len(parts) >= 6:
+                names.append(parts[4])
+
+    tracks = []
+    for name in names:
+        track = os.path.join(folder, name)
+        if track not in tracks:
+            tracks.append(track)
+    return tracks
+
+
+def hash_disc(sheet, jobs=None):
+    """
+    "hash_disc" hashes a disc image described by a CUE or GDI sheet, each track file is hashed
+    on its own thread with "hash_file" so memory use stays bounded
+
+    Args:
+        sheet(required): full path of the .cue or .gdi file
+        jobs(optional, default=number of CPUs): maximum number of tracks hashed at once
+
+    Returns:
+        List of Dictionaries that have the filename, size, crc, md5, sha1, sheet and full path values,
+        the sheet itself first and then one per track
+
+    Raises:
+        None
+    """
+    tracks = parse_disc_sheet(sheet)
+    workers = max(1, min(jobs or os.cpu_count() or 1, len(tracks)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        hashes = list(pool.map(hash_file, tracks))
+
+    crcs = []
+    for src_file, file_hash in zip([sheet] + tracks, [hash_file(sheet)] + hashes):
+        crc_info = {"compress_name": os.path.basename(src_file), "sheet": os.path.basename(sheet),
+                    "path": src_file}
+        crc_info.update(file_hash)
+        crcs.append(crc_info)
+    return crcs
+
+
+def _read_member(fileobj, ext, compressed_name):
+    """
+    "_read_member" reads a single file from a zip or 7z archive into memory
+
+    Args:
+        fileobj(required): seekable file object of the archive
+        ext(required): extension of the archive
+        compressed_name(required): Name of file in archive
+
+    Returns:
+        bytes of the file
+
+    Raises:
+        None
+    """
+    if ext == ".zip":
+        with zipfile.ZipFile(fileobj) as zf:
+            return zf.read(compressed_name)
+    return sevenzip.SevenZipArchive(fileobj).read(compressed_name)
+
+
+def _open_archive(fileobj, ext):
+    """
+    "_open_archive" parses the headers of a zip or 7z archive once, so several files can be read from it
+
+    Args:
+        fileobj(required): seekable file object of the archive
+        ext(required): extension of the archive
+
+    Returns:
+        zipfile.ZipFile or sevenzip.SevenZipArchive, both close and read files by name
+
+    Raises:
+        zipfile.BadZipFile or sevenzip.SevenZipError if the archive can not be read
+    """
+    if ext == ".zip":
+        return zipfile.ZipFile(fileobj)
+    return sevenzip.SevenZipArchive(fileobj)
+
+
+def _unpack_size(archive, compressed_name):
+    """
+    "_unpack_size" returns the bytes held in memory to read a file of an archive opened by "_open_archive",
+    for a 7z that is the whole solid block holding the file
+
+    Args:
+        archive(required): archive opened by "_open_archive"
+        compressed_name(required): Name of file in archive
+
+    Returns:
+        size in bytes
+
+    Raises:
+        KeyError if the file is not in the archive
+    """
+    if isinstance(archive, zipfile.ZipFile):
+        return archive.getinfo(compressed_name).file_size
+    return archive.unpack_size(compressed_name)
+
+
+def _nested_crc_info(data, nested_path, depth=1):
+    """
+    "_nested_crc_info" lists the CRC-32 info of an archive held in memory, descending into any
+    archives inside it
+
+    Args:
+        data(required): bytes of the archive
+        nested_path(required): list of names leading to the archive from the outer file
+        depth(optional, default=1): current nesting level
+
+    Returns:
+        List of Dictionaries that have the filename, size, crc and nested_path values
+
+    Raises:
+        None
+    """
+    ext = os.path.splitext(nested_path[-1])[1].lower()
+    with _open_archive(io.BytesIO(data), ext) as archive:
+        if ext == ".zip":
+            members = [{"compress_name": i.filename, "crc": "%08X" % i.CRC, "size": i.file_size}
+                       for i in archive.infolist() if not i.is_dir()]
+        else:
+            members = archive.crc_info()
 
-        self.rl_path = config.get("RocketLauncher", "path")
-        # Front Ends
-        self.hs_path = config.get("FrontEnds", "HyperSpin")
-        # Utilities
-        self.notepad = config.get("Utilities", "Notepad++")
-        self.clrmamepro = config.get("Utilities", "clrmamepro")
-        # Archives
-        self.rocket_launcher_archive = config.get("Installs", "RocketLauncher")
-        self.rocket_launcher_media_archive = config.get("Installs", "RocketLauncher_Media")
-        self.hyperspin_archive = config.get("Installs", "HyperSpin")
-        self.hyperspin_upgrade_archive = config.get("Installs", "HyperSpin_Upgrade")
+        crcs = []
+        for member in members:
+            member["nested_path"] = nested_path + [member["compress_name"]]
+            crcs.append(member)
+            inner_ext = os.path.splitext(member["compress_name"])[1].lower()
+            if inner_ext not in NESTED_EXTENSIONS or depth >= NESTED_MAX_DEPTH:
+                continue
+            try:
+                if _unpack_size(archive, member["compress_name"]) > NESTED_MAX_SIZE:
+                    continue
+                inner = archive.read(member["compress_name"])
+                crcs.extend(_nested_crc_info(inner, member["nested_path"], depth + 1))
+            except (zipfile.BadZipFile, sevenzip.SevenZipError, lzma.LZMAError, zlib.error, KeyError) as e:
+                msg = "Could not read nested archive {}: {}".format("/".join(member["nested_path"]), e)
+                logger.debug(msg)
+    return crcs
 
 
 class Compressor(Paths):
@@ -121,22 +559,66 @@ class Compressor(Paths):
 
     # Zip File Operations
 
-    def _compress_zip(self):
+    def _compress_zip(self, deterministic=False, threads=None, level=None):
         """
-        "_compress_zip" Method compresses the source file
+        "_compress_zip" Method compresses the source file, large files are deflated on several threads
 
         Args:
-            self
+            deterministic(optional, default=False): Write a TorrentZip style archive, see "_write_deterministic"
+            threads(optional, default=Threads from paths.ini): Amount of processor threads to use
+            level(optional, default=zlib default): Compression level, ignored when deterministic
 
         Returns:
-            None
+            True when the archive was written
 
         Raises:
             None
         """
 
-        with zipfile.ZipFile(self.dst_file, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        if deterministic:
+            with zipfile.ZipFile(self.dst_file, "w", zipfile.ZIP_DEFLATED, allowZip64=True,
+                                 compresslevel=DETERMINISTIC_LEVEL) as zf:
+                self._write_deterministic(zf, self.src_file, os.path.basename(self.src_file))
+            return True
+
+        threads = threads or self.compress_threads
+        if threads > 1 and os.path.getsize(self.src_file) >= PARALLEL_DEFLATE_MIN_SIZE:
+            msg = "Compressing {} on {} threads".format(os.path.basename(self.src_file), threads)
+            logger.debug(msg)
+            ziptools.compress_parallel(self.src_file, self.dst_file, threads=threads,
+                                       level=zlib.Z_DEFAULT_COMPRESSION if level is None else level)
+            return True
+
+        with zipfile.ZipFile(self.dst_file, "w", zipfile.ZIP_DEFLATED, allowZip64=True, compresslevel=level) as zf:
             zf.write(self.src_file, os.path.basename(self.src_file))
+        return True
+
+    @staticmethod
+    def _write_deterministic(zf, src_file, arcname):
+        """
+        "_write_deterministic" Method adds a file to a zip with a fixed timestamp, fixed attributes and the
+        zip's fixed compression level, so the same input always gives the same bytes
+
+        Args:
+            zf(required): open ZipFile to write to
+            src_file(required): full path of the file to add
+            arcname(required): name of the file in the zip
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        zinfo = zipfile.ZipInfo(arcname, date_time=DETERMINISTIC_DATE_TIME)
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.create_system = 0
+        zinfo.external_attr = 0
+        # zf.open doesn't give a ZipInfo the zip's level like ZipFile.write does
+        zinfo._compresslevel = DETERMINISTIC_LEVEL
+        zip64 = os.path.getsize(src_file) * 1.05 > zipfile.ZIP64_LIMIT
+        with open(src_file, "rb") as src, zf.open(zinfo, "w", force_zip64=zip64) as dst:
+            shutil.copyfileobj(src, dst, HASH_CHUNK_SIZE)
 
     def _crc_from_zip(self):
         """
@@ -157,6 +639,7 @@ class Compressor(Paths):
         for i in cf.infolist():
             crc_info["compress_name"] = i.filename
             crc_info["crc"] = str(hex(i.CRC)[2:].zfill(8)).upper()
+            crc_info["size"] = i.file_size
             crcs.append(dict(crc_info))
         return crcs
 
@@ -179,6 +662,26 @@ class Compressor(Paths):
         with zipfile.ZipFile(self.src_file) as zf:
             zf.extract(compressed_name, dst_dir, password)
 
+    def _get_files_from_zip(self, compressed_names, dst_dir, password=None):
+        """
+        "_get_files_from_zip" Method extracts several files from the source file, opening it once
+
+        Args:
+            compressed_names(required): List of names of files in zip
+            dst_dir(required): destination directory to extract the files to
+            password(optional, default = None): password for archive if needed
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+
+        with zipfile.ZipFile(self.src_file) as zf:
+            for compressed_name in compressed_names:
+                zf.extract(compressed_name, dst_dir, password)
+
     # 7zip File Operations
 
     def _compress_seven_zip(self, level=5, threads=4):
@@ -190,7 +693,7 @@ class Compressor(Paths):
             threads(optional, default=4): Amount of processor threads to use
 
         Returns:
-            None
+            True when 7z exited without errors
 
         Raises:
             None
@@ -198,10 +701,34 @@ class Compressor(Paths):
         command = [self.seven_zip_exe, "a", self.dst_file,
                    self.src_file, "-mx{}".format(level), "-mmt{}".format(threads)]
         execute = subprocess.Popen(command)
+        return execute.wait() == 0
 
     def _crc_from_seven_zip(self):
         """
-        "_crc_from_zip" Method returns all CRC-32 info from files in compressed file
+        "_crc_from_seven_zip" Method returns all CRC-32 info from files in compressed file, the 7z
+        headers are read in process and 7z.exe is only used for archives that can not be read natively,
+        e.g. encrypted headers
+
+        Args:
+            self
+
+        Returns:
+            List of Dictionaries that have the filename and crc values
+
+        Raises:
+            None
+        """
+        try:
+            return sevenzip.crc_info(self.src_file)
+        except (sevenzip.SevenZipError, lzma.LZMAError, zlib.error) as e:
+            msg = "Falling back to 7z.exe for {}: {}".format(os.path.basename(self.src_file), e)
+            logger.debug(msg)
+        return self._crc_from_seven_zip_exe()
+
+    def _crc_from_seven_zip_exe(self):
+        """
+        "_crc_from_seven_zip_exe" Method returns all CRC-32 info from files in compressed file by
+        parsing the output of 7z.exe
 
         Args:
             self
@@ -217,13 +744,18 @@ class Compressor(Paths):
         crcs = []
         crc_info = {}
         for line in execute.stdout:
-            if "Path" in line.decode():
-                fname = line.decode().split(" = ")[1].strip("\n\r")
+            line = line.decode()
+            if "Path" in line:
+                fname = line.split(" = ")[1].strip("\n\r")
                 crc_info["compress_name"] = fname
-            elif "CRC" in line.decode():
-                crc = line.decode().split(" = ")[1].strip("\n\r")
+            elif "CRC" in line:
+                crc = line.split(" = ")[1].strip("\n\r")
                 crc_info["crc"] = crc
                 crcs.append(dict(crc_info))
+        if execute.wait() != 0:
+            msg = "7z.exe could not list {}".format(os.path.basename(self.src_file))
+            logger.info(msg)
+            return []
         return crcs
 
     def _get_file_from_seven_zip(self, compressed_name, dst_dir, password=None):
@@ -251,6 +783,43 @@ class Compressor(Paths):
             msg = line.decode().strip("\n\r")
             logger.debug(msg)
 
+    def _get_files_from_seven_zip(self, compressed_names, dst_dir, password=None):
+        """
+        "_get_files_from_seven_zip" Method extracts several files from the source file with a single
+        7z process, so a solid archive is only decompressed once
+
+        Args:
+            compressed_names(required): List of names of files in archive
+            dst_dir(required): destination directory to extract the files to
+            password(optional, default = None): password for archive if needed
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+
+        # Keep each command line well below the Windows limit
+        batches = [[]]
+        length = 0
+        for compressed_name in compressed_names:
+            if length + len(compressed_name) > SEVEN_ZIP_MAX_ARGS and batches[-1]:
+                batches.append([])
+                length = 0
+            batches[-1].append(compressed_name)
+            length += len(compressed_name) + 3
+
+        for batch in batches:
+            # e = extract, -p = password, -o = output dir, -r = recursive, -y = answer yes
+            command = [self.seven_zip_exe, "e",
+                       self.src_file, "-p{}".format(password),
+                       "-o{}".format(dst_dir)] + batch + ["-r", "-y"]
+            execute = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
+            for line in execute.stdout:
+                msg = line.decode().strip("\n\r")
+                logger.debug(msg)
+
     # RAR File Operations
 
     def _compress_rar(self):
@@ -261,7 +830,7 @@ class Compressor(Paths):
             self
 
         Returns:
-            None
+            True when rar exited without errors
 
         Raises:
             None
@@ -270,6 +839,7 @@ class Compressor(Paths):
         # a = add to archive, -ep = adds the archive without the path
         command = [self.rar_exe, "a", "-ep", self.dst_file, self.src_file]
         execute = subprocess.Popen(command)
+        return execute.wait() == 0
 
         # msg = "Not defined yet"
         # logger.critical(msg)
@@ -287,6 +857,7 @@ class Compressor(Paths):
         Raises:
             None
         """
+        import rarfile
         cf = rarfile.RarFile(self.src_file)
         crcs = []
         crc_info = {}
@@ -311,64 +882,114 @@ class Compressor(Paths):
         Raises:
             None
         """
+        import rarfile
         rarfile.UNRAR_TOOL = self.rar_exe
         with rarfile.RarFile(self.src_file) as rf:
             rf.extract(compressed_name, dst_dir, password)
 
+    def _get_files_from_rar(self, compressed_names, dst_dir, password=None):
+        """
+        "_get_files_from_rar" Method extracts several files from the source file, opening it once
+
+        Args:
+            compressed_names(required): List of names of files in archive
+            dst_dir(required): destination directory to extract the files to
+            password(optional, default = None): password for archive if needed
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        import rarfile
+        rarfile.UNRAR_TOOL = self.rar_exe
+        with rarfile.RarFile(self.src_file) as rf:
+            for compressed_name in compressed_names:
+                rf.extract(compressed_name, dst_dir, password)
+
     # Other File Operations
 
     def _crc_from_file(self):
         """
-        "_crc_from_rar" Method returns all CRC-32 info from files in compressed file
+        "_crc_from_file" Method returns the CRC-32, MD5 and SHA1 info of an uncompressed file
 
         Args:
             self
 
         Returns:
-            List of Dictionaries that have the filename and crc values
+            List of Dictionaries that have the filename, size, crc, md5 and sha1 values
 
         Raises:
             None
         """
+        crc_info = {"compress_name": os.path.basename(self.src_file)}
+        crc_info.update(hash_file(self.src_file))
+        return [crc_info]
+
+    def _crc_from_disc(self):
+        """
+        "_crc_from_disc" Method returns the CRC-32, MD5 and SHA1 info of the sheet and of each track of
+        a CUE or GDI disc image
 
-        buf = open(self.src_file, 'rb').read()
-        buf = (binascii.crc32(buf) & 0xFFFFFFFF)
-        return [{"compress_name": os.path.basename(self.src_file), "crc": "%08X" % buf}]
+        Args:
+            self
+
+        Returns:
+            List of Dictionaries that have the filename, size, crc, md5, sha1 and sheet values
+
+        Raises:
+            None
+        """
+        return hash_disc(self.src_file)
 
     # Public Methods
 
-    def compress(self, ext="zip", remove_source=True):
+    def compress(self, ext="zip", remove_source=True, queue=None, deterministic=False, threads=None, dst_dir=None,
+                 level=None):
         """
         "compress" Method compresses the source file using the appropriate internal method
 
         Args:
             ext(optional, default="zip"): Sets the compression method
-            remove_source(optional, default=True): Will remove the source file
+            remove_source(optional, default=True): Will remove the source file once it is compressed
+            queue(optional, default=None): CompressionQueue to run the job on, runs now if None
+            deterministic(optional, default=False): Write a TorrentZip style zip, identical input gives identical bytes
+            threads(optional, default=Threads from paths.ini): Threads used to deflate a large file into a zip
+            dst_dir(optional, default=folder of the source file): Folder to write the archive to
+            level(optional, default=the format's default): Compression level
 
         Returns:
-            None
+            True when the file was compressed, a Future of that result when queued
 
         Raises:
             None
         """
+        if queue:
+            return queue.submit(self, ext=ext, remove_source=remove_source, deterministic=deterministic,
+                                threads=threads, dst_dir=dst_dir, level=level)
 
         self.dst_file = os.path.splitext(self.src_file)[0] + ".{}".format(ext)
+        if dst_dir:
+            self.dst_file = os.path.join(dst_dir, os.path.basename(self.dst_file))
 
         # Check if the zipfile exists
         if os.path.isfile(self.dst_file):
             self._backup_file()
 
+        compressed = False
+
         # Compress the file after ensuring it is a file and not a directory
         if os.path.isfile(self.src_file):
             msg = "Compressing {}".format(os.path.basename(self.src_file))
             logger.debug(msg)
 
             if ext == "zip":
-                self._compress_zip()
+                compressed = self._compress_zip(deterministic, threads, level)
             elif ext == "7z":
-                self._compress_seven_zip()
+                compressed = self._compress_seven_zip(level=5 if level is None else level, threads=threads or 4)
             elif ext == "rar":
-                self._compress_rar()
+                compressed = self._compress_rar()
             else:
                 msg = "{} is not a supported extension".format(ext)
                 logger.debug(msg)
@@ -377,22 +998,148 @@ class Compressor(Paths):
             msg = "{} is a directory".format(os.path.basename(self.src_file))
             logger.debug(msg)
 
-        if remove_source:
+        if not compressed:
+            msg = "Could not compress {}, keeping the source".format(os.path.basename(self.src_file))
+            logger.info(msg)
+        elif remove_source:
             os.remove(self.src_file)
 
-    def get_crc(self):
+        return compressed
+
+    def rename_members(self, renames, dst_file=None):
         """
-        "get_crc" Calculates the CRC-32 using the appropriate internal method
+        "rename_members" Method renames files inside the source zip without recompressing them, only
+        the local headers and the central directory are rewritten
 
         Args:
-            self
+            renames(required): Dictionary of current names in the zip to new names
+            dst_file(optional, default=the source zip): full path of the zip to write, an existing file
+                                                       other than the source is moved to the backup folder
 
         Returns:
+            True when the zip was written
+
+        Raises:
             None
+        """
+        self.dst_file = dst_file or self.src_file
+        if self.dst_file != self.src_file and os.path.isfile(self.dst_file):
+            self._backup_file()
+
+        tmp_file = self.dst_file + ".tmp"
+        try:
+            renamed = ziptools.rename_members(self.src_file, tmp_file, renames)
+            os.replace(tmp_file, self.dst_file)
+        except (zipfile.BadZipFile, ziptools.ZipError, OSError) as e:
+            msg = "Could not rename the files in {}: {}".format(os.path.basename(self.src_file), e)
+            logger.info(msg)
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            return False
+
+        msg = "Renamed {} files in {}".format(renamed, os.path.basename(self.dst_file))
+        logger.debug(msg)
+        return True
+
+    def transplant(self, compressed_name, dst_file, arcname=None):
+        """
+        "transplant" Method copies one file of the source zip into a new zip as raw compressed bytes,
+        the file is not extracted or compressed again
+
+        Args:
+            compressed_name(required): Name of file in the source zip
+            dst_file(required): full path of the zip to write, an existing file is moved to the backup folder
+            arcname(optional, default=compressed_name): Name of the file in the new zip
+
+        Returns:
+            True when the zip was written
 
         Raises:
             None
         """
+        self.dst_file = dst_file
+        if os.path.isfile(self.dst_file):
+            self._backup_file()
+
+        tmp_file = self.dst_file + ".tmp"
+        try:
+            ziptools.transplant(self.src_file, tmp_file, {compressed_name: arcname or compressed_name})
+            os.replace(tmp_file, self.dst_file)
+        except (zipfile.BadZipFile, ziptools.ZipError, KeyError, OSError) as e:
+            msg = "Could not copy {} from {}: {}".format(compressed_name, os.path.basename(self.src_file), e)
+            logger.info(msg)
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            return False
+        return True
+
+    def _crc_from_nested(self, crcs):
+        """
+        "_crc_from_nested" Method adds the CRC-32 info of archives stored inside the source archive,
+        the inner archives are read in memory so no temp files are written
+
+        Args:
+            crcs(required): CRC info of the source archive
+
+        Returns:
+            List of Dictionaries that have the filename and crc values, inner files also have
+            a nested_path, the list of names leading to them from the source archive
+
+        Raises:
+            None
+        """
+        ext = os.path.splitext(self.src_file)[1].lower()
+        candidates = [crc_info["compress_name"] for crc_info in crcs
+                      if os.path.splitext(crc_info["compress_name"])[1].lower() in NESTED_EXTENSIONS]
+        if not candidates:
+            return crcs
+
+        nested = []
+        with open(self.src_file, "rb") as f:
+            # The headers are parsed once and each 7z solid block is decoded at most once
+            try:
+                archive = _open_archive(f, ext)
+            except (zipfile.BadZipFile, sevenzip.SevenZipError) as e:
+                msg = "Could not read nested archives of {}: {}".format(os.path.basename(self.src_file), e)
+                logger.debug(msg)
+                return crcs
+            with archive:
+                for compressed_name in candidates:
+                    try:
+                        # Checked before decoding, a small file in a large solid block costs the whole block
+                        if _unpack_size(archive, compressed_name) > NESTED_MAX_SIZE:
+                            continue
+                        data = archive.read(compressed_name)
+                        nested.extend(_nested_crc_info(data, [compressed_name]))
+                    except (zipfile.BadZipFile, sevenzip.SevenZipError, lzma.LZMAError, zlib.error, KeyError) as e:
+                        msg = "Could not read nested archive {}: {}".format(compressed_name, e)
+                        logger.debug(msg)
+        return crcs + nested
+
+    def get_crc(self, use_catalog=True, nested=True):
+        """
+        "get_crc" Calculates the CRC-32 using the appropriate internal method, files that have not
+        changed since they were last hashed are read from the CRC catalog instead
+
+        Args:
+            use_catalog(optional, default=True): Read and fill in the CRC catalog
+            nested(optional, default=True): Include files inside zip and 7z archives stored in the archive
+
+        Returns:
+            List of Dictionaries that have the filename and crc values
+
+        Raises:
+            None
+        """
+        catalog = None
+        if use_catalog and os.path.isfile(self.src_file):
+            catalog = get_catalog(self.crc_catalog)
+            crcs = catalog.lookup(self.src_file)
+            if crcs is not None:
+                if not nested:
+                    crcs = [crc_info for crc_info in crcs if "nested_path" not in crc_info]
+                return crcs
+
         if os.path.isfile(self.src_file):
             try:
                 msg = "Gathering CRCs from {}".format(os.path.basename(self.src_file))
@@ -408,12 +1155,51 @@ class Compressor(Paths):
             crcs = self._crc_from_seven_zip()
         elif ext.lower() == ".rar":
             crcs = self._crc_from_rar()
+        elif ext.lower() in DISC_SHEETS:
+            crcs = self._crc_from_disc()
         else:
             crcs = self._crc_from_file()
 
+        if ext.lower() in NESTED_EXTENSIONS and nested:
+            crcs = self._crc_from_nested(crcs)
+
+        # Only complete listings are catalogued, an empty one is usually a failed read and is retried
+        if catalog and nested and crcs:
+            catalog.store(self.src_file, crcs)
+
         return crcs
 
-    def extract(self, compressed_name, dst_dir, password=None):
+    def _get_nested_file(self, nested_path, dst_dir):
+        """
+        "_get_nested_file" Method extracts a file from an archive inside the source archive, the inner
+        archives are held in memory and the file is streamed to the destination directory
+
+        Args:
+            nested_path(required): list of names leading to the file from the source archive
+            dst_dir(required): destination directory to extract the file to
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        ext = os.path.splitext(self.src_file)[1].lower()
+        dst = os.path.join(dst_dir, os.path.basename(nested_path[-1]))
+        with open(self.src_file, "rb") as f:
+            fileobj = f
+            for compressed_name in nested_path[:-1]:
+                fileobj = io.BytesIO(_read_member(fileobj, ext, compressed_name))
+                ext = os.path.splitext(compressed_name)[1].lower()
+
+            if ext == ".zip":
+                with zipfile.ZipFile(fileobj) as zf, zf.open(nested_path[-1]) as src, open(dst, "wb") as out:
+                    shutil.copyfileobj(src, out, HASH_CHUNK_SIZE)
+            else:
+                with open(dst, "wb") as out:
+                    out.write(_read_member(fileobj, ext, nested_path[-1]))
+
+    def extract(self, compressed_name, dst_dir, password=None, nested_path=None):
         """
         "extract" extracts a specific file from an archive
 
@@ -421,6 +1207,8 @@ class Compressor(Paths):
             compressed_name(required): Name of file in archive
             dst_dir(required): destination directory to extract the file to
             password(optional, default = None): password for archive if needed
+            nested_path(optional, default = None): names leading to a file inside a nested archive,
+                as reported by get_crc, the file is extracted to dst_dir without its path
 
         Returns:
             None
@@ -434,7 +1222,9 @@ class Compressor(Paths):
 
             ext = os.path.splitext(self.src_file)[1]
 
-            if ext == ".zip":
+            if nested_path and len(nested_path) > 1:
+                self._get_nested_file(nested_path, dst_dir)
+            elif ext == ".zip":
                 self._get_file_from_zip(compressed_name, dst_dir, password)
             elif ext == ".7z":
                 self._get_file_from_seven_zip(compressed_name, dst_dir, password)
@@ -444,6 +1234,40 @@ class Compressor(Paths):
                 msg = "{} is not a valid archive".format(self.src_file)
                 logger.info(msg)
 
+    def extract_many(self, compressed_names, dst_dir, password=None):
+        """
+        "extract_many" extracts several files from an archive in one pass, loose source files
+        are copied instead
+
+        Args:
+            compressed_names(required): List of names of files in archive
+            dst_dir(required): destination directory to extract the files to
+            password(optional, default = None): password for archive if needed
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        if os.path.isfile(self.src_file):
+            msg = "Extracting {} files from {}".format(len(compressed_names), os.path.basename(self.src_file))
+            logger.debug(msg)
+
+            ext = os.path.splitext(self.src_file)[1]
+
+            if ext == ".zip":
+                self._get_files_from_zip(compressed_names, dst_dir, password)
+            elif ext == ".7z":
+                self._get_files_from_seven_zip(compressed_names, dst_dir, password)
+            elif ext == ".rar":
+                self._get_files_from_rar(compressed_names, dst_dir, password)
+            elif os.path.basename(self.src_file) in compressed_names:
+                shutil.copy(self.src_file, os.path.join(dst_dir, os.path.basename(self.src_file)))
+            else:
+                msg = "{} is not a valid archive".format(self.src_file)
+                logger.info(msg)
+
     def extract_all(self, dst_dir, password=None):
         """
         "extract_all" extracts all contents of archive
@@ -477,19 +1301,454 @@ class Compressor(Paths):
             msg = line.decode().strip("\n\r")
             logger.debug(msg)
 
-    def compress_dir(self, dst_file, remove_source=True):
-        with zipfile.ZipFile(dst_file, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
-            absolute_src = os.path.abspath(self.src_file)
+    def compress_dir(self, dst_file, remove_source=True, deterministic=False):
+        """
+        "compress_dir" compresses the contents of the source directory into a zip
+
+        Args:
+            dst_file(required): path of the zip to write
+            remove_source(optional, default=True): Will remove the source directory
+            deterministic(optional, default=False): Write a TorrentZip style archive with sorted members
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        absolute_src = os.path.abspath(self.src_file)
+        if deterministic:
+            members = []
             for dirname, subdirs, files in os.walk(self.src_file):
                 for fname in files:
                     absolute_name = os.path.join(dirname, fname)
-                    arcname = absolute_name[len(absolute_src) + 1:]
-                    zf.write(absolute_name, arcname)
+                    arcname = absolute_name[len(absolute_src) + 1:].replace(os.sep, "/")
+                    members.append((arcname, absolute_name))
+            with zipfile.ZipFile(dst_file, "w", zipfile.ZIP_DEFLATED, allowZip64=True,
+                                 compresslevel=DETERMINISTIC_LEVEL) as zf:
+                for arcname, absolute_name in sorted(members, key=lambda member: member[0].lower()):
+                    self._write_deterministic(zf, absolute_name, arcname)
+        else:
+            with zipfile.ZipFile(dst_file, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+                for dirname, subdirs, files in os.walk(self.src_file):
+                    for fname in files:
+                        absolute_name = os.path.join(dirname, fname)
+                        arcname = absolute_name[len(absolute_src) + 1:]
+                        zf.write(absolute_name, arcname)
 
         if remove_source:
             shutil.rmtree(self.src_file)
 
 
+class CompressionQueue:
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, compressor, ext="zip", remove_source=True, callback=None, deterministic=False, threads=None,
+               dst_dir=None, level=None):
+        """
+        "submit" is a method that queues a compression job, at most max_workers jobs run at once and
+        the source is only removed after its job succeeds
+
+        Args:
+            compressor(required): Compressor of the file to compress
+            ext(optional, default="zip"): Sets the compression method
+            remove_source(optional, default=True): Will remove the source file once it is compressed
+            callback(optional, default=None): called with the Future when the job finishes
+            deterministic(optional, default=False): Write a TorrentZip style zip
+            threads(optional, default=Threads from paths.ini): Threads used to deflate a large file
+            dst_dir(optional, default=folder of the source file): Folder to write the archive to
+            level(optional, default=the format's default): Compression level
+
+        Returns:
+            Future with the result of Compressor.compress
+
+        Raises:
+            None
+        """
+        future = self._executor.submit(compressor.compress, ext=ext, remove_source=remove_source,
+                                       deterministic=deterministic, threads=threads, dst_dir=dst_dir,
+                                       level=level)
+        with self._lock:
+            self._jobs[future] = compressor.src_file
+        if callback:
+            future.add_done_callback(callback)
+        return future
+
+    def wait_all(self):
+        """
+        "wait_all" is a method that blocks until every queued job is finished
+
+        Args:
+            self
+
+        Returns:
+            list of source files that failed to compress
+
+        Raises:
+            None
+        """
+        with self._lock:
+            jobs = dict(self._jobs)
+            self._jobs.clear()
+        concurrent.futures.wait(jobs)
+
+        failed = []
+        for future, src_file in jobs.items():
+            try:
+                compressed = future.result()
+            except Exception as e:
+                msg = "Compressing {} failed: {}".format(os.path.basename(src_file), e)
+                logger.info(msg)
+                compressed = False
+            if not compressed:
+                failed.append(src_file)
+
+        msg = "Finished {} compression jobs, {} failed".format(len(jobs), len(failed))
+        logger.info(msg)
+        return failed
+
+    def shutdown(self):
+        """
+        "shutdown" is a method that waits for all jobs and stops the worker threads
+
+        Args:
+            self
+
+        Returns:
+            list of source files that failed to compress
+
+        Raises:
+            None
+        """
+        failed = self.wait_all()
+        self._executor.shutdown()
+        return failed
+
+
+class StagingArea(Paths):
+
+    def __init__(self, name, budget=None):
+        Paths.__init__(self)
+
+        self.budget = self.staging_budget if budget is None else budget
+        # No staging_path set means everything is staged on disk
+        self.ram_dir = os.path.join(self.staging_path, name) if self.staging_path else None
+        self.disk_dir = os.path.join(self.temp_path, "Staging", name)
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        """
+        "reserve" is a method that picks the folder to extract files to, the staging folder while the
+        files fit in what is left of the budget, the temp folder on disk when they don't
+
+        Args:
+            size(required): Total size in bytes of the files, None if unknown
+
+        Returns:
+            Tuple of the folder and the bytes reserved, pass the bytes to "release" once the files are gone
+
+        Raises:
+            None
+        """
+        with self._lock:
+            if self.ram_dir and size is not None and self._used + size <= self.budget:
+                self._used += size
+                folder = self.ram_dir
+            else:
+                size = 0
+                folder = self.disk_dir
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        return folder, size
+
+    def release(self, size):
+        """
+        "release" is a method that gives reserved bytes back to the budget
+
+        Args:
+            size(required): bytes returned by "reserve"
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        with self._lock:
+            self._used = max(0, self._used - size)
+
+
+class RomStore(Paths):
+
+    def __init__(self):
+        Paths.__init__(self)
+
+        self._lock = threading.Lock()
+
+    def _object_path(self, key, ext):
+        return os.path.join(self.store_path, key[:2], key + ext.lower())
+
+    @staticmethod
+    def _content_key(src_file):
+        """
+        "_content_key" is a method that identifies a file by what it holds rather than by its bytes: the
+        name, size and CRC-32 of every file in an archive, or the hashes of a loose file.  The listing is
+        read through the CRC catalog, so files seen before are not read again
+
+        Args:
+            src_file(required): full path of the file
+
+        Returns:
+            hex SHA1 of the listing, None if the file could not be read
+
+        Raises:
+            None
+        """
+        crcs = [crc_info for crc_info in Compressor(src_file).get_crc() if "nested_path" not in crc_info]
+        if not crcs:
+            return None
+        members = sorted((crc_info["compress_name"].replace(os.sep, "/"), crc_info["crc"].upper(),
+                          crc_info.get("size"), crc_info.get("sha1")) for crc_info in crcs)
+        listing = json.dumps([os.path.splitext(src_file)[1].lower(), members])
+        return hashlib.sha1(listing.encode("utf-8")).hexdigest()
+
+    def add(self, src_file):
+        """
+        "add" is a method that puts a file in the store under the key of its contents, see "_content_key",
+        and replaces the file with a hard link to the stored object, so files holding the same ROMs share
+        one copy on disk.  Archives only share a copy when they hold the same files under the same names,
+        the same ROM named after each system's DAT stays a copy per system since the name is in the archive
+
+        Args:
+            src_file(required): full path of the file, usually a compressed ROM
+
+        Returns:
+            key of the file, None if it could not be read
+
+        Raises:
+            None
+        """
+        key = self._content_key(src_file)
+        if key is None:
+            msg = "Could not read {}, not adding it to the store".format(src_file)
+            logger.debug(msg)
+            return None
+        obj = self._object_path(key, os.path.splitext(src_file)[1])
+
+        with self._lock:
+            try:
+                if not os.path.isdir(os.path.dirname(obj)):
+                    os.makedirs(os.path.dirname(obj))
+                if not os.path.isfile(obj):
+                    os.link(src_file, obj)
+                elif not os.path.samefile(src_file, obj):
+                    # Link next to the file first so it is never missing
+                    tmp_link = src_file + ".link"
+                    os.link(obj, tmp_link)
+                    os.replace(tmp_link, src_file)
+                    msg = "{} is a duplicate, linked to {}".format(os.path.basename(src_file), obj)
+                    logger.debug(msg)
+            except OSError as e:
+                msg = "Could not link {} into the store, keeping the copy: {}".format(src_file, e)
+                logger.debug(msg)
+
+        return key
+
+    def find_duplicates(self, folders=None):
+        """
+        "find_duplicates" is a method that finds files holding the same contents across ROM folders, see
+        "_content_key", the listings come from the CRC catalog so only new or changed files are read.
+        Files that are already hard links of each other are not reported
+
+        Args:
+            folders(optional, default=all folders in the ROM path): list of folders to check
+
+        Returns:
+            list of lists of duplicate file paths
+
+        Raises:
+            None
+        """
+        if folders is None:
+            folders = [entry.path for entry in os.scandir(self.rom_path) if entry.is_dir()]
+
+        inodes = {}
+        for folder in folders:
+            for entry in os.scandir(folder):
+                if entry.is_file():
+                    stat = entry.stat()
+                    inodes.setdefault((stat.st_dev, stat.st_ino), entry.path)
+
+        by_key = {}
+        for path in inodes.values():
+            key = self._content_key(path)
+            if key is not None:
+                by_key.setdefault(key, []).append(path)
+
+        return [sorted(paths) for paths in by_key.values() if len(paths) > 1]
+
+    def report_duplicates(self, folders=None, link=False):
+        """
+        "report_duplicates" is a method that logs the duplicate files across ROM folders and the disk
+        space they waste, optionally replacing them with hard links into the store
+
+        Args:
+            folders(optional, default=all folders in the ROM path): list of folders to check
+            link(optional, default=False): replace the duplicates with hard links
+
+        Returns:
+            list of lists of duplicate file paths
+
+        Raises:
+            None
+        """
+        duplicates = self.find_duplicates(folders)
+        wasted = 0
+        for paths in duplicates:
+            # Archives of the same files can differ in size, all but one copy is wasted
+            wasted += sum(os.path.getsize(path) for path in paths[1:])
+            msg = "Duplicate files: {}".format(", ".join(paths))
+            logger.info(msg)
+            if link:
+                for path in paths:
+                    self.add(path)
+
+        msg = "Found {} sets of duplicate files wasting {:.1f} MB".format(len(duplicates), wasted / 1024 / 1024)
+        logger.info(msg)
+        return duplicates
+
+
+def _escape_xml(data):
+    # Same escaping minidom uses when it writes text and attribute values
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+
+class XmlWriter:
+    """
+    Writes an XML document element by element, indented the way "Arcade.prettify" indents, so large
+    databases go straight to the file without building a tree first.  The output is byte for byte what
+    ElementTree followed by minidom's toprettyxml(indent="\t") writes for the same elements
+
+        with open(xml, mode="w") as f, XmlWriter(f) as writer:
+            writer.start("menu")
+            writer.element("game", attrib={"name": "Pac-Man"})
+            writer.end("menu")
+    """
+
+    def __init__(self, fileobj, indent="\t"):
+        self.fileobj = fileobj
+        self.indent = indent
+        self._open = []
+        # The start tag of the last element stays open until we know if it has children
+        self._pending = False
+        self.fileobj.write('<?xml version="1.0" ?>\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def _start_tag(self, tag, attrib):
+        self.fileobj.write(self.indent * len(self._open) + "<" + tag)
+        for name, value in (attrib or {}).items():
+            self.fileobj.write(' {}="{}"'.format(name, _escape_xml(str(value))))
+
+    def _close_pending(self):
+        if self._pending:
+            self.fileobj.write(">\n")
+            self._pending = False
+
+    def start(self, tag, attrib=None):
+        """
+        "start" opens an element that will have child elements
+
+        Args:
+            tag(required): name of the element
+            attrib(optional, default=None): Dictionary of attributes, written in order
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self._close_pending()
+        self._start_tag(tag, attrib)
+        self._open.append(tag)
+        self._pending = True
+
+    def end(self, tag):
+        """
+        "end" closes the element opened last by "start"
+
+        Args:
+            tag(required): name of the element
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: tag is not the element open
+        """
+        if not self._open or self._open[-1] != tag:
+            raise ValueError("{} is not the open element".format(tag))
+        self._open.pop()
+        if self._pending:
+            self.fileobj.write("/>\n")
+            self._pending = False
+        else:
+            self.fileobj.write(self.indent * len(self._open) + "</{}>\n".format(tag))
+
+    def element(self, tag, text=None, attrib=None):
+        """
+        "element" writes an element without child elements
+
+        Args:
+            tag(required): name of the element
+            text(optional, default=None): text of the element, empty text writes an empty element
+            attrib(optional, default=None): Dictionary of attributes, written in order
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self._close_pending()
+        self._start_tag(tag, attrib)
+        text = "" if text is None else str(text)
+        if text:
+            # A parser turns line breaks into \n, do the same
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+            self.fileobj.write(">{}</{}>\n".format(_escape_xml(text), tag))
+        else:
+            self.fileobj.write("/>\n")
+
+    def close(self):
+        """
+        "close" closes every element still open
+
+        Args:
+            self
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        while self._open:
+            self.end(self._open[-1])
+
+
 class Arcade(Paths):
 
     def __init__(self):
@@ -1,4 +1,5 @@
 import os
+import csv
 import shutil
 import logging
 import configparser
@@ -6,10 +7,8 @@ import time
 import math
 import xml.etree.cElementTree as ET
 
-from PIL import Image
-
-from general import Arcade, Compressor
-from utilities import Databases
+from general import Arcade, Compressor, XmlWriter
+from utilities import Databases, facet_games
 from rocketlauncher import RocketLauncher
 from models.system import System
 
@@ -20,7 +19,7 @@ LOG_FORMAT = logging.Formatter("[{}] [%(levelname)s] [%(name)s] : %(message)s".f
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-file_handler = logging.FileHandler(LOG_FILE)
+file_handler = logging.FileHandler(LOG_FILE, delay=True)
 file_handler.setLevel(logging.DEBUG)
 file_handler.setFormatter(LOG_FORMAT)
 
@@ -31,6 +30,25 @@ stream_handler.setFormatter(LOG_FORMAT)
 # logger.addHandler(file_handler)
 logger.addHandler(stream_handler)
 
+# Characters Windows doesn't allow in a file name
+FILE_NAME_INVALID = '\\/:*?"<>|'
+
+# Genres written to genre.xml, in order
+GENRES = ("Action", "Adventure", "Ball & Paddle", "Beat-'Em-Up",
+          "Biking", "Board", "Breakout", "Card Battle", "Casino", "Climbing",
+          "Compilation", "Driving", "Educational", "Favorites", "Fighter",
+          "Flying", "Game Show", "Gun", "Mahjong", "Mature", "Maze",
+          "Mini-", "Miscellaneous", "Motorcycle", "Multimedia", "Party", "Pinball",
+          "Platform", "Puzzle", "Quiz", "Rhythm", "Role-Playing",
+          "Shoot-'Em-Up", "Shooter", "Simulation", "Spinner", "Strategy", "Surfing",
+          "Tabletop", "Trackball", "Utility", "Virtual Life", "Wakeboarding", "Water",
+          "Sports",
+          "Baseball", "Basketball", "Bowling", "Boxing", "Cricket", "Fishing", "Football",
+          "Futuristic", "Golf", "Handball", "Hockey", "Horse Racing", "Hunting", "Olympic",
+          "Pool and Dart", "Rugby", "Skateboarding", "Skating", "Skiing",
+          "Snowboarding", "Soccer", "Tennis", "Track & Field", "Volleyball",
+          "Wrestling")
+
 
 class HyperSpin(Arcade, System):
 
@@ -415,16 +433,7 @@ class HyperSpin(Arcade, System):
         Raises:
             None
         """
-        msg = "Reading HyperSpin Main Menu XML database ..."
-        logger.info(msg)
-        xml = os.path.join(self.hs_path, "Databases", "Main Menu", "Main Menu.xml")
-        tree = ET.parse(xml)
-        doc = tree.getroot()
-        systems = []
-        for child in doc:
-            system = child.get("name")
-            systems.append(system)
-        return systems
+        return read_main_menu(self.hs_path)
 
     def _write_hs_menu(self, sort=False, remove=False):
         """
@@ -470,19 +479,15 @@ class HyperSpin(Arcade, System):
         xml = os.path.join(self.hs_path, "Databases", "Main Menu", "Main Menu.xml")
         try:
             shutil.copy(xml, "{}_backup_{}.xml".format(xml, time.strftime("%Y%m%d")))
-            root = ET.Element("menu")
-            for name in final_systems:
-                ET.SubElement(root, "game", name=name["name"])
         except FileNotFoundError:
             msg = "System Menu does not exist"
             logger.info(msg)
-            root = ET.Element("menu")
-            for name in final_systems:
-                ET.SubElement(root, "game", name=name["name"])
 
-        pretty = self.prettify(root)
-        with open(xml, mode="w") as xml:
-            xml.write(pretty)
+        with open(xml, mode="w") as xml, XmlWriter(xml) as writer:
+            writer.start("menu")
+            for name in final_systems:
+                writer.element("game", attrib={"name": name["name"]})
+            writer.end("menu")
 
     def _create_hs_database(self):
         """
@@ -504,10 +509,10 @@ class HyperSpin(Arcade, System):
         # Get the database from RocketLauncher
         src_db = os.path.join(self.rl_path, "RocketLauncherUI", "Databases", self.system, "{}.xml".format(self.system))
         hs_db = Databases(system=self.system)
-        db = hs_db.audit(files_to_audit=os.path.join(self.rom_path, self.system), db=src_db, audit_type="rom")
+        roms = hs_db.iter_audit(files_to_audit=os.path.join(self.rom_path, self.system), db=src_db, audit_type="rom")
 
         # Audit for available ROMs
-        have = [rom for rom in db if rom["rom"]]
+        have = [rom for rom in roms if rom["rom"]]
         dst_db = os.path.join(self.db_path, "{}.xml".format(self.system))
         if not os.path.isdir(os.path.dirname(dst_db)):
             os.makedirs(os.path.dirname(dst_db))
@@ -517,57 +522,45 @@ class HyperSpin(Arcade, System):
         # Write the database to the system
         hs_db.write_rom_xml(games=have, xml=dst_db)
 
-    def _write_genre_xml(self, genre):
+    def _write_genre_xml(self, genre, games):
         """
         "_write_genre_xml" writes genre databases for available genres
 
         Args:
             self
             genre: name of genre to create the database for
+            games: audited games that have the genre
 
         Returns:
-            genre
+            name of the genre in genre.xml
 
         Raises:
             None
         """
-        # Audit the ROMS and only include the ones we have
-        src_db = os.path.join(self.rl_path, "RocketLauncherUI", "Databases", self.system, "{}.xml".format(self.system))
-        hs_db = Databases(system=self.system)
-        db = hs_db.audit(files_to_audit=os.path.join(self.rom_path, self.system), db=src_db, audit_type="rom")
-        have = [rom for rom in db if rom["rom"]]
-
         # Format the naming of the Genres
         if genre == "Mini-":
-            xml = os.path.join(self.hs_path, "Databases", self.system, "Mini-Games.xml")
             genre_name = "Mini-Games"
         else:
-            xml = os.path.join(self.hs_path, "Databases", self.system, genre + " Games.xml")
             genre_name = "{} Games".format(genre)
-        output = []
+        # Other facets are free text and may hold characters a file name can't
+        genre_name = "".join(c for c in genre_name if c not in FILE_NAME_INVALID).strip()
+        xml = os.path.join(self.hs_path, "Databases", self.system, genre_name + ".xml")
 
-        # Cycle thru the ROMs and match the Genre to current
-        for rom in have:
-            if not rom["genre"]:
-                msg = "{} does not have a Genre assigned".format(rom["name"])
-                logger.debug(msg)
-            else:
-                if genre == rom["genre"]:
-                    output.append(rom)
-        if not output:
-            msg = "No ROMS match {} genre".format(genre)
-            logger.debug(msg)
-            return genre
-        else:
-            hs_db.write_rom_xml(games=output, xml=xml, list_name="{} {}".format(self.system, genre_name))
-            return ""
+        msg = "Creating Genre XML for {} genre".format(genre)
+        logger.info(msg)
+        hs_db = Databases(system=self.system)
+        hs_db.write_rom_xml(games=games, xml=xml, list_name="{} {}".format(self.system, genre_name))
+        return genre_name
 
-    def _create_genres(self):
+    def _create_genres(self, facets=("genre",)):
         """
-        "_create_genres" creates genre databases for ROMs matching the genre label in the database
+        "_create_genres" creates genre databases for ROMs matching the genre label in the database.  The
+        available games are grouped in one pass, so only genres that have games are written
 
         Args:
             self
+            facets: fields to group the games by, each value gets a database, e.g. ("genre", "year",
+                    "manufacturer"). Only the genres in GENRES are listed in genre.xml
 
         Returns:
             None
@@ -575,45 +568,46 @@ class HyperSpin(Arcade, System):
         Raises:
             None
         """
+        # Audit the ROMS and only include the ones we have
+        src_db = os.path.join(self.rl_path, "RocketLauncherUI", "Databases", self.system, "{}.xml".format(self.system))
+        hs_db = Databases(system=self.system)
+        roms = hs_db.iter_audit(files_to_audit=os.path.join(self.rom_path, self.system), db=src_db, audit_type="rom")
+        have = [rom for rom in roms if rom["rom"]]
+
+        groups = facet_games(have, facets)
+        for rom in have:
+            if not rom["genre"]:
+                msg = "{} does not have a Genre assigned".format(rom["name"])
+                logger.debug(msg)
 
-        categories = ("Action", "Adventure", "Ball & Paddle", "Beat-'Em-Up",
-                      "Biking", "Board", "Breakout", "Card Battle", "Casino", "Climbing",
-                      "Compilation", "Driving", "Educational", "Favorites", "Fighter",
-                      "Flying", "Game Show", "Gun", "Mahjong", "Mature", "Maze",
-                      "Mini-", "Miscellaneous", "Motorcycle", "Multimedia", "Party", "Pinball",
-                      "Platform", "Puzzle", "Quiz", "Rhythm", "Role-Playing",
-                      "Shoot-'Em-Up", "Shooter", "Simulation", "Spinner", "Strategy", "Surfing",
-                      "Tabletop", "Trackball", "Utility", "Virtual Life", "Wakeboarding", "Water",
-                      "Sports",
-                      "Baseball", "Basketball", "Bowling", "Boxing", "Cricket", "Fishing", "Football",
-                      "Futuristic", "Golf", "Handball", "Hockey", "Horse Racing", "Hunting", "Olympic",
-                      "Pool and Dart", "Rugby", "Skateboarding", "Skating", "Skiing",
-                      "Snowboarding", "Soccer", "Surfing", "Tennis", "Track & Field", "Volleyball",
-                      "Wrestling")
-        non_matches = []  # Holder for any Genre that doesn't match in the ROM set
-        for i in categories:
-            # Write the specific genre database
-            no_match = self._write_genre_xml(i)
-            msg = "Creating Genre XML for {} genre".format(i)
+        # Only the known genres go in genre.xml, in their usual order
+        menu = []
+        genres = groups.get("genre", {})
+        for genre in GENRES:
+            if genre in genres:
+                menu.append(self._write_genre_xml(genre, genres[genre]))
+        for genre in sorted(set(genres) - set(GENRES)):
+            msg = "{} is not a HyperSpin genre, skipping {} games".format(genre, len(genres[genre]))
             logger.info(msg)
-            # if the genre exists, add to the list to build the genre.xml
-            non_matches.append(no_match)
+
+        # Other facets get their databases but stay out of genre.xml
+        for facet in facets:
+            if facet == "genre":
+                continue
+            for value in sorted(groups[facet]):
+                self._write_genre_xml(value, groups[facet][value])
 
         # Build the genre.xml menu list
-        root = ET.Element("menu")
-        ET.SubElement(root, "game", name="All Games")
-        for genre in categories:
-            if genre not in non_matches:
-                if genre == "Mini-":
-                    ET.SubElement(root, "game", name=genre + "Games")
-                else:
-                    ET.SubElement(root, "game", name=genre + " Games")
         xml = os.path.join(self.hs_path, "Databases", self.system, "genre.xml")
-        pretty = self.prettify(root)
-        with open(xml, mode="w") as xml:
-            xml.write(pretty)
+        with open(xml, mode="w") as xml, XmlWriter(xml) as writer:
+            writer.start("menu")
+            writer.element("game", attrib={"name": "All Games"})
+            for genre_name in menu:
+                writer.element("game", attrib={"name": genre_name})
+            writer.end("menu")
 
     def resize_width(self, src, dst, width):
+        from PIL import Image
         img = Image.open(src)
         width_percent = width / img.size[0]
         height = math.ceil(img.size[1] * width_percent)
@@ -682,10 +676,8 @@ class HyperSpin(Arcade, System):
         xml = os.path.join(self.db_path, self.system + ".xml")
 
         hs = Databases(system=self.system)
-        header, db = hs.read_system_xml(db=xml)
-
         # Just worried about the ROM name in the database
-        names = [name["name"] for name in db]
+        names = set(game["name"] for game in hs.iter_system_xml(xml))
 
         batch_file = os.path.join(self.temp_path, "{} HS Media Links run as Admin.bat".format(self.system))
         if os.path.isfile(batch_file):
@@ -792,6 +784,7 @@ class HyperSpin(Arcade, System):
         # self._do_media(themes, action=action, batch_file=batch_file)
 
     def _build_theme(self):
+        from PIL import Image
         msg = "Building Main Menu Theme for {}".format(self.system)
         logger.info(msg)
         main_bg = os.path.join("assets", "background.png")
@@ -958,6 +951,133 @@ class HyperSpin(Arcade, System):
         self._set_up_media(action=action, three_d=three_d)
         self._build_theme()
 
+    # Media audit
+    def _media_folders(self):
+        """
+        "_media_folders" returns the folder each audit of a game looks in, keyed by the audit fields of
+        the database
+
+        Args:
+            self
+
+        Returns:
+            Dictionary of audit types to folders
+
+        Raises:
+            None
+        """
+        return {"rom": os.path.join(self.rom_path, self.system),
+                "artwork1": self.artwork1_path,
+                "artwork2": self.artwork2_path,
+                "artwork3": self.artwork3_path,
+                "artwork4": self.artwork4_path,
+                "wheel": self.wheel_path,
+                "video": self.video_path,
+                "theme": self.themes_path}
+
+    def audit_media(self, report=True):
+        """
+        "audit_media" audits the ROMs and media of the system against its HyperSpin database, every media
+        folder is scanned once, and logs what is there and what is missing
+
+        Args:
+            self
+            report (optional, default=True): writes "<system> Media Audit.csv" to the logs folder with a
+                                             row per game and a column per audit
+
+        Returns:
+            Dictionary of audit types to a Dictionary with the "have" count and a "miss" list of game names,
+            None if the system has no database
+
+        Raises:
+            None
+        """
+        db = os.path.join(self.db_path, "{}.xml".format(self.system))
+        if not os.path.isfile(db):
+            msg = "{} has no HyperSpin database to audit the media against".format(self.system)
+            logger.info(msg)
+            return None
+
+        folders = self._media_folders()
+        games = Databases(system=self.system).iter_audit(files_to_audit=folders, db=db)
+
+        # Games are counted and written to the report as they stream from the database
+        results = dict((audit_type, {"have": 0, "miss": []}) for audit_type in folders)
+        report_file = None
+        writer = None
+        if report:
+            if not os.path.isdir(self.log_path):
+                os.makedirs(self.log_path)
+            report_file = open(os.path.join(self.log_path, "{} Media Audit.csv".format(self.system)),
+                               mode="w", newline="")
+            writer = csv.writer(report_file)
+            writer.writerow(["name"] + list(folders))
+        try:
+            for game in games:
+                for audit_type in folders:
+                    if game[audit_type]:
+                        results[audit_type]["have"] += 1
+                    else:
+                        results[audit_type]["miss"].append(game["name"])
+                if writer:
+                    writer.writerow([game["name"]] + ["have" if game[audit_type] else "miss"
+                                                      for audit_type in folders])
+        finally:
+            if report_file:
+                report_file.close()
+
+        for audit_type, result in results.items():
+            msg = "{} {}: have {}, missing {}".format(self.system, audit_type, result["have"], len(result["miss"]))
+            logger.info(msg)
+            for name in result["miss"]:
+                msg = "{} is missing {} for {}".format(self.system, audit_type, name)
+                logger.debug(msg)
+        return results
+
+
+def read_main_menu(hs_path):
+    """
+    "read_main_menu" reads the systems in the Main Menu.xml database, a.k.a. the Main Menu
+
+    Args:
+        hs_path (required): path to the HyperSpin folder
+
+    Returns:
+        a list of Systems
+
+    Raises:
+        None
+    """
+    msg = "Reading HyperSpin Main Menu XML database ..."
+    logger.info(msg)
+    xml = os.path.join(hs_path, "Databases", "Main Menu", "Main Menu.xml")
+    tree = ET.parse(xml)
+    doc = tree.getroot()
+    systems = []
+    for child in doc:
+        system = child.get("name")
+        systems.append(system)
+    return systems
+
+
+def audit_all_media(report=True):
+    """
+    "audit_all_media" audits the ROMs and media of every system in the HyperSpin Main Menu
+
+    Args:
+        report (optional, default=True): writes a media audit report for each system
+
+    Returns:
+        Dictionary of system names to the results of "audit_media"
+
+    Raises:
+        None
+    """
+    results = {}
+    for system in read_main_menu(Arcade().hs_path):
+        results[system] = HyperSpin(system=system).audit_media(report=report)
+    return results
+
 
 if __name__ == "__main__":
     nes = "Nintendo 64"
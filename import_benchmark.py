@@ -0,0 +1,58 @@
+import os
+import sys
+import subprocess
+
+MODULES = ["general", "utilities", "models.system", "rocketlauncher", "hyperspin", "main"]
+
+
+def import_time(module, slowest=5):
+    """
+    "import_time" imports a module in a fresh interpreter with "-X importtime" and reads the timings
+    Python reports for every module it loaded
+
+    Args:
+        module(required): dotted name of the module to import
+        slowest(optional, default=5): number of the slowest imports to return
+
+    Returns:
+        Tuple of the total import time in seconds and a list of (seconds, module) of the slowest imports,
+        None if the import failed
+
+    Raises:
+        None
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.PIPE,
+                            stdout=subprocess.DEVNULL, universal_newlines=True)
+    if result.returncode != 0:
+        return None
+
+    # Lines look like "import time:   self [us] | cumulative | imported package"
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented by two more spaces per level
+        depth = (len(name) - len(name.lstrip())) // 2
+        timings.append((int(cumulative_us) / 1e6, depth, name.strip()))
+
+    total = sum(seconds for seconds, depth, name in timings if depth == 0)
+    direct = [(seconds, name) for seconds, depth, name in timings if depth == 1]
+    return total, sorted(direct, reverse=True)[:slowest]
+
+
+def main():
+    for module in MODULES:
+        timing = import_time(module)
+        if timing is None:
+            print("{:<16} failed to import".format(module))
+            continue
+        total, slowest = timing
+        print("{:<16} {:.3f}s".format(module, total))
+        for seconds, name in slowest:
+            print("    {:<28} {:.3f}s".format(name, seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,10 @@ import os
 import time
 
 from rocketlauncher import RocketLauncher
-from hyperspin import HyperSpin
+from hyperspin import HyperSpin, audit_all_media
 from models.system import System
 from utilities import EmuMovies
+from general import RomStore
 
 
 def install_arcade(fe="HyperSpin"):
@@ -30,8 +31,11 @@ def create_system(system, fe="HyperSpin"):
     if system in dont_search:
         curated_sets = platform.software_lists + platform.nointro + platform.goodset
     else:
-        curated_sets = platform.tosec_dirs() + platform.software_lists + platform.nointro + platform.goodset
+        curated_sets = (platform.tosecs or []) + platform.software_lists + platform.nointro + platform.goodset
     platform.build_rom_set(source_set=curated_sets)
+    # Disc systems are matched track by track against their Redump DAT
+    if platform.redump:
+        platform.build_disc_set(source_set=platform.redump)
     emu = EmuMovies(system=system)
     emu.create_blanks()
 
@@ -53,7 +57,7 @@ def update_system(system, source_set, update_roms=True, action="copy", three_d=F
         emu = EmuMovies(system=system)
         emu.create_blanks()
         if len(source_set) == 0:
-            curated_sets = platform.tosec_dirs() + platform.software_lists + platform.nointro + platform.goodset
+            curated_sets = (platform.tosecs or []) + platform.software_lists + platform.nointro + platform.goodset
             platform.build_rom_set(source_set=curated_sets)
         else:
             platform.build_rom_set(source_set=source_set)
@@ -84,6 +88,22 @@ def delete_system(system, fe="HyperSpin", remove_assets=False):
         pass
 
 
+def dedup_roms(link=False):
+    store = RomStore()
+    store.report_duplicates(link=link)
+
+
+def normalise_roms(system):
+    platform = System(system)
+    platform.normalise_roms()
+
+
+def audit_media(systems=None):
+    if systems is None:
+        return audit_all_media()
+    return {system: HyperSpin(system=system).audit_media() for system in systems}
+
+
 def bunch_of_new_stuff(group):
     for i in group:
         create_system(system=i, fe="all")
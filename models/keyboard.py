@@ -31,13 +31,20 @@ def key(event):
         # root.destroy()
 
 
-root = tk.Tk()
-print("Press a key (Escape key to exit):")
-root.bind_all('<Key>', key)
-# don't show the tk window
-root.withdraw()
-root.mainloop()
+root = None
 
-print("The code is: {}, char is {}".format(code, chr(code)))
 
+def main():
+    global root
+    root = tk.Tk()
+    print("Press a key (Escape key to exit):")
+    root.bind_all('<Key>', key)
+    # don't show the tk window
+    root.withdraw()
+    root.mainloop()
+    if code != "":
+        print("The code is: {}, char is {}".format(code, chr(code)))
 
+
+if __name__ == "__main__":
+    main()
@@ -15,17 +15,17 @@ class Rom(Compressor):
         self.name = name
         self.system = system
 
-    def rename_extension(self, extension):
+    def extension_name(self, extension):
         """
-        "rename_extension" is a method that will rename the extension of the ROM to the
-        first extension name in the system model
+        "extension_name" is a method that returns the name the ROM gets from "rename_extension"
+        without renaming anything
 
         Args:
             self
             extension: the name of the extension to rename to.
 
         Returns:
-            Newly named ROM name
+            ROM name with the new extension
 
         Raises:
             None
@@ -36,17 +36,37 @@ class Rom(Compressor):
             extension = ".{}".format(extension)
         else:
             extension = ".zip"
-        rom_path = os.path.join(self.rom_path, self.system, self.name)
         f, ext = os.path.splitext(self.name)
-        if ext != extension and ext not in exclude_ext and rom_path is not os.path.isdir(rom_path):
-            dst = os.path.join(self.rom_path, self.system, f + extension)
-            msg = "Renaming {} to {}".format(self.name, f + extension)
+        if ext != extension and ext not in exclude_ext:
+            return f + extension
+        return self.name
+
+    def rename_extension(self, extension):
+        """
+        "rename_extension" is a method that will rename the extension of the ROM to the
+        first extension name in the system model
+
+        Args:
+            self
+            extension: the name of the extension to rename to.
+
+        Returns:
+            Newly named ROM name
+
+        Raises:
+            None
+        """
+        rom_name = self.extension_name(extension)
+        rom_path = os.path.join(self.rom_path, self.system, self.name)
+        if rom_name != self.name:
+            dst = os.path.join(self.rom_path, self.system, rom_name)
+            msg = "Renaming {} to {}".format(self.name, rom_name)
 
             os.rename(rom_path, dst)
         else:
             msg = "{}'s extension is named correctly".format(self.name)
 
-        return os.path.join(self.rom_path, self.system, f + extension)
+        return os.path.join(self.rom_path, self.system, rom_name)
 
     def fuzzy_match(self, file_to_match, assurance=.75):
         """
@@ -3,9 +3,16 @@ import time
 import json
 import os
 import sys
-
-from general import Paths, Compressor
-from utilities import Databases
+import shutil
+import pickle
+import threading
+import zipfile
+import concurrent.futures
+import contextlib
+
+from general import Paths, Compressor, CompressionQueue, RomStore, StagingArea, get_catalog, parse_disc_sheet, \
+    DISC_SHEETS
+from utilities import Databases, NoIntro, Redump
 from models.rom import Rom
 
 LOG_FILE = "../../arcade.log"
@@ -15,7 +22,7 @@ LOG_FORMAT = logging.Formatter("[{}] [%(levelname)s] [%(name)s] : %(message)s".f
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-file_handler = logging.FileHandler(LOG_FILE)
+file_handler = logging.FileHandler(LOG_FILE, delay=True)
 file_handler.setLevel(logging.DEBUG)
 file_handler.setFormatter(LOG_FORMAT)
 
@@ -27,6 +34,213 @@ stream_handler.setFormatter(LOG_FORMAT)
 logger.addHandler(stream_handler)
 
 
+ARCHIVE_EXTENSIONS = (".zip", ".7z", ".rar")
+
+# Used when the system model has no "compression" from "benchmark_compression"
+DEFAULT_COMPRESSION = {"format": "zip", "level": None, "threads": None}
+
+SYSTEMS_DIR = os.path.join(os.path.dirname(__file__), "systems")
+REGISTRY_FILE = "system_models.pickle"
+REGISTRY_VERSION = 1
+
+_registry = None
+_registry_lock = threading.Lock()
+_games_db = {}
+
+
+def _model_record(data):
+    """
+    "_model_record" drops the GamesDb payload from a system model, keeping the manufacturer which is
+    the only GamesDb value read for every system
+
+    Args:
+        data: Dictionary of the system model JSON
+
+    Returns:
+        Dictionary of the system model without "GamesDbData"
+
+    Raises:
+        None
+    """
+    record = dict((key, value) for key, value in data.items() if key != "GamesDbData")
+    platform = data.get("GamesDbData", {}).get("Platform", {})
+    record["manufacturer"] = platform.get("manufacturer")
+    return record
+
+
+def _load_registry():
+    """
+    "_load_registry" returns the compact records of every system model.  The records are kept for the
+    process and in a cache file in the temp folder, a model is only parsed again when its JSON file's
+    modified time changes
+
+    Args:
+        None
+
+    Returns:
+        Dictionary of system names to records, None for models that are not valid JSON
+
+    Raises:
+        None
+    """
+    global _registry
+    signature = {}
+    with os.scandir(SYSTEMS_DIR) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(".json"):
+                signature[entry.name] = entry.stat().st_mtime_ns
+
+    with _registry_lock:
+        if _registry is not None and _registry["signature"] == signature:
+            return _registry["models"]
+
+        cache_file = os.path.join(Paths().temp_path, REGISTRY_FILE)
+        cached = _registry
+        if cached is None:
+            try:
+                with open(cache_file, mode="rb") as f:
+                    cached = pickle.load(f)
+                if cached.get("version") != REGISTRY_VERSION:
+                    cached = None
+            except (OSError, EOFError, pickle.UnpicklingError, AttributeError) as e:
+                logger.debug(e)
+                cached = None
+        old_signature = cached["signature"] if cached else {}
+        old_models = cached["models"] if cached else {}
+
+        models = {}
+        for fname, mtime in signature.items():
+            system = fname[:-len(".json")]
+            if old_signature.get(fname) == mtime and system in old_models:
+                models[system] = old_models[system]
+                continue
+            try:
+                with open(os.path.join(SYSTEMS_DIR, fname), mode="r") as f:
+                    models[system] = _model_record(json.load(f))
+            except ValueError as e:
+                msg = "Could not read the system model {}: {}".format(fname, e)
+                logger.debug(msg)
+                models[system] = None
+
+        _registry = {"version": REGISTRY_VERSION, "signature": signature, "models": models}
+        if signature != old_signature:
+            try:
+                with open(cache_file + ".tmp", mode="wb") as f:
+                    pickle.dump(_registry, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(cache_file + ".tmp", cache_file)
+            except OSError as e:
+                logger.debug(e)
+        return models
+
+
+def _save_compression(model, compression):
+    """
+    "_save_compression" sets the "compression" key of a system model, changing only that line so the
+    hand formatted rest of the file is kept
+
+    Args:
+        model(required): path of the system model JSON
+        compression(required): Dictionary of the compression settings
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    with open(model, mode="r") as f:
+        text = f.read()
+    data = json.loads(text)
+    value = json.dumps(compression, ensure_ascii=False)
+    lines = text.splitlines(True)
+    key = [i for i, line in enumerate(lines) if line.lstrip().startswith('"compression":')]
+    if key:
+        line = lines[key[0]]
+        indent = line[:len(line) - len(line.lstrip())]
+        comma = "," if line.rstrip().endswith(",") else ""
+        lines[key[0]] = '{}"compression": {}{}\n'.format(indent, value, comma)
+    else:
+        # Add it as the first key, indented like the next one
+        indent = lines[1][:len(lines[1]) - len(lines[1].lstrip())] if len(lines) > 2 else "  "
+        comma = "," if data else ""
+        lines.insert(1, '{}"compression": {}{}\n'.format(indent, value, comma))
+    new_text = "".join(lines)
+
+    data["compression"] = compression
+    try:
+        edited = json.loads(new_text) == data
+    except ValueError:
+        edited = False
+    if not edited:
+        # The key spans several lines, write the whole model instead
+        new_text = json.dumps(data, indent=2, ensure_ascii=False) + "\n"
+    with open(model, mode="w") as f:
+        f.write(new_text)
+
+
+def get_model(system):
+    """
+    "get_model" returns the compact record of a system model from the registry
+
+    Args:
+        system: name of the system
+
+    Returns:
+        Dictionary of the system model without "GamesDbData", None if there is no valid model
+
+    Raises:
+        None
+    """
+    return _load_registry().get(system)
+
+
+def get_games_db(system):
+    """
+    "get_games_db" reads the GamesDb payload of a system model, only when it is asked for
+
+    Args:
+        system: name of the system
+
+    Returns:
+        Dictionary of the "GamesDbData" of the model, None if there is none
+
+    Raises:
+        None
+    """
+    model = os.path.join(SYSTEMS_DIR, "{}.json".format(system))
+    try:
+        mtime = os.stat(model).st_mtime_ns
+    except OSError:
+        return None
+    if system not in _games_db or _games_db[system][0] != mtime:
+        with open(model, mode="r") as f:
+            _games_db[system] = (mtime, json.load(f).get("GamesDbData"))
+    return _games_db[system][1]
+
+
+def _scan_file(source_file):
+    """
+    "_scan_file" gathers the CRC info of a single source file, kept at module level so it can be
+    sent to a worker process
+
+    Args:
+        source_file: full path of the file
+
+    Returns:
+        List of Dictionaries that have the filename and crc values, None if the file could not be read
+
+    Raises:
+        None
+    """
+    c = Compressor(src_file=source_file)
+    try:
+        return c.get_crc(use_catalog=False)
+    except Exception as e:
+        msg = "Error with file: {} - {}".format(os.path.basename(source_file), e)
+        logger.debug(msg)
+        return None
+
+
 class System(Paths):
 
     def __init__(self, system=None):
@@ -68,14 +282,33 @@ class System(Paths):
         self.read_model()
 
         # ----- ROM Set Paths -----
-        try:
-            self.tosecs = self.tosec_dirs()
-        except Exception as e:
-            self.tosecs = None
-            logger.debug(e)
+        # Walking the TOSEC tree is slow on the master drive, "tosecs" does it on first use
+        self._tosecs = None
+        self._tosecs_read = False
+
+    @property
+    def games_db(self):
+        """
+        GamesDb data of the system model, read from the JSON the first time it is used
+        """
+        return get_games_db(self.system)
 
     # ----- TOSEC -----
 
+    @property
+    def tosecs(self):
+        """
+        TOSEC directories of the system from "tosec_dirs", walked the first time they are used
+        """
+        if not self._tosecs_read:
+            try:
+                self._tosecs = self.tosec_dirs()
+            except Exception as e:
+                self._tosecs = None
+                logger.debug(e)
+            self._tosecs_read = True
+        return self._tosecs
+
     def tosec_dirs(self):
         """
         "tosec_dirs" is a method that will recursively set all directories
@@ -111,10 +344,13 @@ class System(Paths):
         Raises:
             None
         """
-        model = os.path.join(os.path.dirname(__file__), "systems", "{}.json".format(self.system))
-        if os.path.isfile(model):
+        model = os.path.join(SYSTEMS_DIR, "{}.json".format(self.system))
+        data = get_model(self.system)
+        if data is None and os.path.isfile(model):
+            # Not in the registry, read it so a broken model raises as before
             with open(model, mode="r") as f:
-                data = json.load(f)
+                data = _model_record(json.load(f))
+        if data is not None:
 
             if "emulator" in data:
                 self.emulator = data["emulator"]
@@ -129,6 +365,9 @@ class System(Paths):
                 self.platform_type = data["platformType"]
             if "emuMoviesName" in data:
                 self.emu_movies_name = data["emuMoviesName"]
+            self.compression = dict(DEFAULT_COMPRESSION)
+            if "compression" in data:
+                self.compression.update(data["compression"])
 
             if data["romSets"]["TOSEC"] is not None:
                 self.tosec = data["romSets"]["TOSEC"]
@@ -152,12 +391,16 @@ class System(Paths):
                     for stuff in data["romSets"]["SoftwareLists"]:
                         dirs.append(os.path.join(self.mstr_sl, stuff))
                     self.software_lists = dirs
+            if data["romSets"].get("Redump"):
+                self.redump = [os.path.join(self.mstr_redump, data["romSets"]["Redump"])]
+                self.redump_db = data["romSets"]["Redump"]
+            else:
+                self.redump = []
             if data["romSets"]["NoGoodSet"] is not None:
                 self.no_good_set = [os.path.join(self.mstr_non_good_set, data["romSets"]["NoGoodSet"])]
             #     self.software_lists = [os.path.join(self.mstr_sl, data["romSets"]["SoftwareLists"])]
 
-            games_db = data["GamesDbData"]["Platform"]
-            self.manufacturer = games_db["manufacturer"]
+            self.manufacturer = data["manufacturer"]
         else:
             msg = "No system model exists for {}, will create a sample one".format(self.system)
             logger.info(msg)
@@ -188,18 +431,21 @@ class System(Paths):
                 }
             }
         }
-        system_file = os.path.join(os.path.dirname(__file__), "systems", "{}.json".format(self.system))
+        system_file = os.path.join(SYSTEMS_DIR, "{}.json".format(self.system))
         with open(system_file, mode="w") as f:
             f.write(json.dumps(model, indent=4))
 
     # ----- Build ROM Set and helper functions -----
 
-    def _filter_sets_by_crcs(self, source_set):
+    def _filter_sets_by_crcs(self, source_set, jobs=None):
         """
-        "_filter_sets_by_crcs" is a method that will build a dictionary of ROMs with unique crcs
+        "_filter_sets_by_crcs" is a method that will build a dictionary of ROMs with unique crcs.
+        Files already in the CRC catalog are read from it, the rest are hashed by a pool of workers,
+        threads for archive headers and processes for loose files
 
         Args:
             source_set, type list, the source list of directories
+            jobs, type int, number of workers, defaults to the number of CPUs, 1 scans serially
 
         Returns:
             filtered list of dictionaries of ROM names with CRC and source file name
@@ -207,9 +453,10 @@ class System(Paths):
         Raises:
             None
         """
-        crc_names = []
-        index_id = 0
+        if jobs is None:
+            jobs = os.cpu_count() or 1
 
+        source_files = []
         for source_group in source_set:
             if os.path.isdir(source_group):
                 rom_names = os.listdir(source_group)
@@ -217,43 +464,168 @@ class System(Paths):
                 msg = "Found {} files in {}".format(num_of_roms, source_group)
                 logger.info(msg)
 
+                # Track files are hashed through their CUE/GDI sheet
+                tracks = set()
                 for rom_file in rom_names:
-                    source_file = os.path.join(source_group, rom_file)
-                    if os.path.isfile(source_file):
-                        c = Compressor(src_file=source_file)
+                    if os.path.splitext(rom_file)[1].lower() in DISC_SHEETS:
                         try:
-                            rom_crc_list = c.get_crc()
-                        except:
-                            msg = "Error with file: {}".format(rom_file)
-                            logger.debug(msg)
-                        for rom_name in rom_crc_list:
-                            rom_name["name"] = source_file
-                            crc_names.append(rom_name)
+                            tracks.update(parse_disc_sheet(os.path.join(source_group, rom_file)))
+                        except OSError as e:
+                            logger.debug(e)
+
+                for rom_file in rom_names:
+                    source_file = os.path.join(source_group, rom_file)
+                    if os.path.isfile(source_file) and source_file not in tracks:
+                        source_files.append(source_file)
             else:
                 msg = "{} not a valid directory".format(source_group)
                 logger.debug(msg)
 
+        # Read what we can from the catalog, queue the rest
+        catalog = get_catalog(self.crc_catalog)
+        results = {}
+        archives = []
+        loose_files = []
+        for source_file in source_files:
+            crcs = catalog.lookup(source_file)
+            if crcs is not None:
+                results[source_file] = crcs
+            elif os.path.splitext(source_file)[1].lower() in ARCHIVE_EXTENSIONS:
+                archives.append(source_file)
+            else:
+                loose_files.append(source_file)
+
+        if jobs > 1 and (archives or loose_files):
+            with contextlib.ExitStack() as pools:
+                # Only start the pools there is work for, worker processes are slow to spawn
+                futures = {}
+                if archives:
+                    threads = pools.enter_context(concurrent.futures.ThreadPoolExecutor(max_workers=jobs))
+                    for source_file in archives:
+                        futures[threads.submit(_scan_file, source_file)] = source_file
+                if loose_files:
+                    processes = pools.enter_context(
+                        concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(loose_files))))
+                    for source_file in loose_files:
+                        futures[processes.submit(_scan_file, source_file)] = source_file
+                for future in concurrent.futures.as_completed(futures):
+                    results[futures[future]] = self._store_scan(catalog, futures[future], future.result())
+        else:
+            for source_file in archives + loose_files:
+                results[source_file] = self._store_scan(catalog, source_file, _scan_file(source_file))
+
+        # Keep the directory listing order so the output is deterministic
+        crc_names = []
+        for source_file in source_files:
+            for rom_name in results[source_file]:
+                rom_name["name"] = source_file
+                crc_names.append(rom_name)
+
         msg = "Found {} ROMs in the folders".format(len(crc_names))
         logger.info(msg)
 
         # Filter out duplicate CRCs
-        crcs_all = []
+        crcs_all = set()
         final_crcs = []
-        for i in range(len(crc_names)):
-            crc = crc_names[i]['crc']
-            if crc not in crcs_all:
-                crcs_all.append(crc)
-                final_crcs.append(crc_names[i])
+        for crc_name in crc_names:
+            if crc_name["crc"] not in crcs_all:
+                crcs_all.add(crc_name["crc"])
+                final_crcs.append(crc_name)
 
         return final_crcs
 
-    def _match_crcs(self, source_set):
+    @staticmethod
+    def _store_scan(catalog, source_file, crcs):
+        """
+        "_store_scan" is a method that saves a scan result to the CRC catalog
+
+        Args:
+            catalog: the CrcCatalog to fill in
+            source_file: full path of the scanned file
+            crcs: the CRC info from "_scan_file", None or empty if the file could not be read
+
+        Returns:
+            the CRC info, an empty list if the file could not be read
+
+        Raises:
+            None
+        """
+        if not crcs:
+            # Nothing is catalogued for a file that could not be read so it is retried next time
+            return []
+        catalog.store(source_file, crcs)
+        return crcs
+
+    @staticmethod
+    def _hashes_match(rom, available_rom):
+        """
+        "_hashes_match" is a method that compares a database ROM to an available ROM using the
+        strongest hash both of them have, SHA1 then MD5 then CRC-32
+
+        Args:
+            rom: Dictionary of the database ROM
+            available_rom: Dictionary of the available ROM from "_filter_sets_by_crcs"
+
+        Returns:
+            True if the ROMs match
+
+        Raises:
+            None
+        """
+        for digest in ("sha1", "md5"):
+            if rom.get(digest) and available_rom.get(digest):
+                return rom[digest].lower() == available_rom[digest].lower()
+        return rom["crc"] == available_rom["crc"]
+
+    def _add_dat_digests(self, roms):
+        """
+        "_add_dat_digests" is a method that copies the MD5 and SHA1 of the system's No Intro DAT onto
+        database ROMs, found by name when the CRC-32 agrees or else by a CRC-32 only one DAT ROM has
+
+        Args:
+            roms: list of database ROMs, updated in place
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        nointro_db = getattr(self, "nointro_db", None)
+        if not nointro_db:
+            return
+        digests = NoIntro(self.system).read_digests(nointro_db)
+        by_crc = {}
+        for digest in digests.values():
+            by_crc.setdefault(digest["crc"], []).append(digest)
+
+        added = 0
+        for rom in roms:
+            crc = (rom["crc"] or "").upper()
+            digest = digests.get(rom["name"])
+            # A different dump under the same name keeps its own CRC
+            if digest is not None and crc and digest["crc"] != crc:
+                digest = None
+            if digest is None and len(by_crc.get(crc, [])) == 1:
+                digest = by_crc[crc][0]
+            if digest is None:
+                continue
+            if not rom["crc"]:
+                rom["crc"] = digest["crc"]
+            rom["md5"] = digest["md5"]
+            rom["sha1"] = digest["sha1"]
+            added += 1
+        msg = "Added No Intro MD5 and SHA1 to {} of {} ROMs".format(added, len(roms))
+        logger.info(msg)
+
+    def _match_crcs(self, source_set, jobs=None):
         """
         "_match_crcs" is a method that will compare the RocketLauncher database ROM list with the available
         ROM list from the "_filter_sets_by_crcs" method
 
         Args:
-            None
+            source_set: Path of ROMs to build from
+            jobs: number of workers used to scan the source set
 
         Returns:
             final list of dictionaries of ROMs to copy
@@ -265,16 +637,19 @@ class System(Paths):
         # Get the ROM list from RocketLauncher's Database
         xml = os.path.join(self.rl_path, "RocketLauncherUI", "Databases", self.system, self.system + ".xml")
         hs = Databases(self.system)
-        db = hs.audit(files_to_audit=os.path.join(self.rom_path, self.system), db=xml, audit_type="rom")
+        roms = hs.iter_audit(files_to_audit=os.path.join(self.rom_path, self.system), db=xml, audit_type="rom")
 
-        miss = [rom for rom in db if not rom["rom"]]
+        miss = [rom for rom in roms if not rom["rom"]]
         # have = [rom for rom in db if rom["rom"]]
 
         msg ="There are {} ROMs missing from the ROM audit".format(len(miss))
         logger.info(msg)
 
+        # The RocketLauncher database only has CRCs, the No Intro DAT adds the MD5 and SHA1
+        self._add_dat_digests(miss)
+
         # Get the ROM list of available ROMs
-        available_roms = self._filter_sets_by_crcs(source_set=source_set)
+        available_roms = self._filter_sets_by_crcs(source_set=source_set, jobs=jobs)
         msg = "Found {} unique ROMs in the folders".format(len(available_roms))
         logger.info(msg)
 
@@ -282,10 +657,11 @@ class System(Paths):
         final_rom_set = []
         for rom in miss:
             for available_rom in available_roms:
-                if rom["crc"] == available_rom["crc"]:
+                if self._hashes_match(rom, available_rom):
                     f, ext = os.path.splitext(available_rom["compress_name"])
-                    available_rom["dst"] = os.path.join(self.rom_path, self.system, "{}{}".format(rom["name"], ext))
-                    final_rom_set.append(available_rom)
+                    match = dict(available_rom)
+                    match["dst"] = os.path.join(self.rom_path, self.system, "{}{}".format(rom["name"], ext))
+                    final_rom_set.append(match)
 
         msg = "Matched {} ROMs from the available ROMs to the missing ROMs".format(len(final_rom_set))
         logger.info(msg)
@@ -308,38 +684,403 @@ class System(Paths):
         Raises:
             None
         """
+        self._copy_roms(src_file["src"], [src_file], rename, compress)
+
+    def _copy_roms(self, src, src_files, rename=True, compress=True, queue=None, deterministic=False, store=None,
+                   staging=None, compression=None):
+        """
+        "_copy_roms" is a method that will extract all of the wanted ROM files from one source archive
+        in a single pass, then rename and re-compress each of them
+
+        Args:
+            src:  Full path of the source archive
+            src_files:  List of dictionaries with the "extract" and "db_name" values, and a "nested_path"
+                        for files inside nested archives
+            rename: Boolean, if true, renames the extension
+            compress: Boolean, if true, compresses the file
+            queue: CompressionQueue to compress on, compresses immediately if None
+            deterministic: Boolean, if true, writes TorrentZip style zips
+            store: RomStore to hard link the compressed ROMs into
+            staging: StagingArea to extract and compress in, works in the ROM folder if None
+            compression: Dictionary of the archive format, level and threads, defaults to the system's
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        dst_dir = os.path.join(self.rom_path, self.system)
+        compression = compression or self.compression
+
+        # Deflated files in a source zip are copied into their new zips as raw compressed bytes
+        if compress and not deterministic and compression["format"] == "zip":
+            deflated = self._deflated_members(src)
+            remaining = []
+            for src_file in src_files:
+                if src_file.get("nested_path") or src_file["extract"] not in deflated:
+                    remaining.append(src_file)
+                elif not self._transplant_rom(src, src_file, rename, store):
+                    remaining.append(src_file)
+            src_files = remaining
+            if not src_files:
+                return
+
+        names = []
+        nested = []
+        for src_file in src_files:
+            if src_file.get("nested_path"):
+                if src_file["nested_path"] not in nested:
+                    nested.append(src_file["nested_path"])
+            elif src_file["extract"] not in names:
+                names.append(src_file["extract"])
+
+        # Only the finished archives are written to the ROM folder when staging
+        work_dir = dst_dir
+        staged = False
+        if staging:
+            sizes = [src_file.get("size") for src_file in src_files]
+            work_dir, reserved = staging.reserve(None if None in sizes else sum(sizes))
+            staged = reserved > 0
+
+        c = Compressor(src)
+        if names:
+            c.extract_many(names, dst_dir=work_dir)
+        for nested_path in nested:
+            c.extract(nested_path[-1], dst_dir=work_dir, nested_path=nested_path)
+
+        for i, src_file in enumerate(src_files):
+            extracted = os.path.join(work_dir, src_file["extract"])
+            if not os.path.exists(extracted):
+                extracted = os.path.join(work_dir, os.path.basename(src_file["extract"]))
+            # Another ROM still needs this file, so leave it in place
+            keep = any(later["extract"] == src_file["extract"] and
+                       later.get("nested_path") == src_file.get("nested_path") for later in src_files[i + 1:])
+            self._finish_rom(extracted, src_file, rename, compress, keep, queue, deterministic, store,
+                             staging, src_file["size"] if staged else 0, compression)
+
+    @staticmethod
+    def _deflated_members(src):
+        """
+        "_deflated_members" is a method that lists the deflated files of a source zip, those can be
+        copied into a new zip without being recompressed
+
+        Args:
+            src:  Full path of the source archive
+
+        Returns:
+            set of the names of the deflated files, empty if the source is not a zip
+
+        Raises:
+            None
+        """
+        if os.path.splitext(src)[1].lower() != ".zip":
+            return set()
+        try:
+            with zipfile.ZipFile(src) as zf:
+                return set(member.filename for member in zf.infolist()
+                           if member.compress_type == zipfile.ZIP_DEFLATED and not member.flag_bits & 0x1)
+        except (zipfile.BadZipFile, OSError):
+            return set()
+
+    def _transplant_rom(self, src, src_file, rename=True, store=None):
+        """
+        "_transplant_rom" is a method that copies a ROM from a source zip into its own zip in the ROM
+        folder under the database name, the compressed data is copied as is
+
+        Args:
+            src:  Full path of the source zip
+            src_file:  Dictionary of values that have the source, destination
+            rename: Boolean, if true, renames the extension
+            store: RomStore to hard link the new zip into
+
+        Returns:
+            True when the zip was written
+
+        Raises:
+            None
+        """
+        r = Rom(system=self.system, name=os.path.basename(src_file["db_name"]))
+        rom_name = r.extension_name(self.extensions) if rename else r.name
+        dst = os.path.join(self.rom_path, self.system, os.path.splitext(rom_name)[0] + ".zip")
+        c = Compressor(src)
+        if not c.transplant(src_file["extract"], dst_file=dst, arcname=rom_name):
+            return False
+        if store:
+            store.add(dst)
+        return True
+
+    def normalise_roms(self, rename=True):
+        """
+        "normalise_roms" is a method that renames the single file zips in the system's ROM folder, and the
+        file inside each of them, to the RocketLauncher database name matching the file's CRC.  The files
+        are renamed without being recompressed
+
+        Args:
+            rename: Boolean, if true, renames the extension of the file inside the zip
+
+        Returns:
+            Number of zips renamed
+
+        Raises:
+            None
+        """
+        rom_dir = os.path.join(self.rom_path, self.system)
+        xml = os.path.join(self.rl_path, "RocketLauncherUI", "Databases", self.system, self.system + ".xml")
+        hs = Databases(self.system)
+        system, roms = hs.read_system_xml(xml)
+        db_names = {}
+        for rom in roms:
+            if rom.get("crc"):
+                db_names.setdefault(rom["crc"], rom["name"])
+
+        with os.scandir(rom_dir) as entries:
+            zips = [entry.path for entry in entries if entry.is_file() and entry.name.lower().endswith(".zip")]
+
+        renamed = 0
+        for zip_file in zips:
+            try:
+                with zipfile.ZipFile(zip_file) as zf:
+                    members = [member for member in zf.infolist() if not member.is_dir()]
+            except zipfile.BadZipFile:
+                msg = "{} is not a valid zip".format(os.path.basename(zip_file))
+                logger.info(msg)
+                continue
+            if len(members) != 1:
+                continue
+            member = members[0]
+            db_name = db_names.get("{:08X}".format(member.CRC))
+            if db_name is None:
+                continue
+
+            r = Rom(system=self.system, name=db_name + os.path.splitext(member.filename)[1])
+            rom_name = r.extension_name(self.extensions) if rename else r.name
+            dst = os.path.join(rom_dir, db_name + ".zip")
+            same_file = os.path.normcase(zip_file) == os.path.normcase(dst)
+            if member.filename == rom_name and zip_file == dst:
+                continue
+            if not same_file and os.path.exists(dst):
+                msg = "File Exists - {}".format(os.path.basename(dst))
+                logger.debug(msg)
+                continue
+
+            # Only rewrite the zip when the file inside it needs a new name
+            if member.filename != rom_name:
+                c = Compressor(zip_file)
+                if not c.rename_members({member.filename: rom_name}):
+                    continue
+            if zip_file != dst:
+                os.rename(zip_file, dst)
+            renamed += 1
+
+        msg = "Renamed {} of {} zips in {}".format(renamed, len(zips), rom_dir)
+        logger.info(msg)
+        return renamed
+
+    def _finish_rom(self, extracted, src_file, rename=True, compress=True, keep=False, queue=None,
+                    deterministic=False, store=None, staging=None, staged=0, compression=None):
+        """
+        "_finish_rom" is a method that will rename an extracted ROM to its database name, rename
+        the extension and re-compress it into the ROM folder
+
+        Args:
+            extracted:  Full path of the extracted file, in the ROM folder or a staging folder
+            src_file:  Dictionary of values that have the source, destination
+            rename: Boolean, if true, renames the extension
+            compress: Boolean, if true, compresses the file
+            keep: Boolean, if true, copies the extracted file instead of renaming it
+            queue: CompressionQueue to compress on, compresses immediately if None
+            deterministic: Boolean, if true, writes TorrentZip style zips
+            store: RomStore to hard link the compressed ROM into
+            staging: StagingArea the file was extracted to
+            staged: bytes of the staging budget to release once the ROM is done
+            compression: Dictionary of the archive format, level and threads, defaults to zip
+
+        Returns:
+            None
 
-        c = Compressor(src_file["src"])
+        Raises:
+            None
+        """
+        dst_dir = os.path.join(self.rom_path, self.system)
+        work_dir = os.path.dirname(extracted)
+        r = Rom(system=self.system, name=os.path.basename(src_file["db_name"]))
+        rom_name = r.extension_name(self.extensions) if rename else r.name
+        dst = os.path.join(work_dir, rom_name)
+        renamed = False
         try:
-            c.extract(src_file["extract"], dst_dir=os.path.join(self.rom_path, self.system))
-            src = os.path.join(self.rom_path, self.system, src_file["extract"])
-            dst = os.path.join(self.rom_path, self.system, src_file["db_name"])
             # Rename the ROM to the RocketLauncher Database Name
-            os.rename(src, dst)
+            if os.path.exists(dst) and dst != extracted:
+                raise FileExistsError(dst)
+            if keep:
+                shutil.copy(extracted, dst)
+            else:
+                os.rename(extracted, dst)
+            renamed = True
             # Compress
-            if rename:
-                r = Rom(name=dst, system=self.system)
-                new_dst = r.rename_extension(self.extensions)
-                if compress:
-                    c = Compressor(new_dst)
-                    c.compress(ext="zip")
-            elif compress:
-                c = Compressor(dst)
-                c.compress(ext="zip")
+            if compress:
+                self._compress_rom(dst, queue, deterministic, store, dst_dir, staging, staged, compression)
+                return
+            if work_dir != dst_dir:
+                if os.path.exists(os.path.join(dst_dir, rom_name)):
+                    raise FileExistsError(rom_name)
+                shutil.move(dst, dst_dir)
         except FileExistsError:
             msg = "File Exists - {}".format(src_file["extract"])
             logger.debug(msg)
+        except FileNotFoundError:
+            msg = "Could not extract {}".format(src_file["extract"])
+            logger.debug(msg)
+        except OSError as e:
+            msg = "Could not copy {}: {}".format(src_file["extract"], e)
+            logger.info(msg)
+        if staging:
+            # Don't leave the files of a ROM that failed in the staging folder
+            leftovers = [dst] if renamed else [] if keep else [extracted]
+            for leftover in leftovers:
+                if os.path.isfile(leftover):
+                    os.remove(leftover)
+            staging.release(staged)
+
+    @staticmethod
+    def _compress_rom(src, queue=None, deterministic=False, store=None, dst_dir=None, staging=None, staged=0,
+                      compression=None):
+        """
+        "_compress_rom" is a method that compresses a ROM and, once that succeeded, adds the archive to
+        the ROM store.  A staged ROM that could not be compressed is moved to the ROM folder as is
+
+        Args:
+            src: Full path of the ROM
+            queue: CompressionQueue to compress on, compresses immediately if None
+            deterministic: Boolean, if true, writes TorrentZip style zips
+            store: RomStore to hard link the compressed ROM into
+            dst_dir: Folder to write the archive to, defaults to the folder of the ROM
+            staging: StagingArea the ROM was extracted to
+            staged: bytes of the staging budget to release once the ROM is compressed
+            compression: Dictionary of the archive format, level and threads, defaults to zip
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        c = Compressor(src)
+
+        def finish(compressed):
+            if compressed and store:
+                store.add(c.dst_file)
+            if not compressed and dst_dir and os.path.dirname(src) != dst_dir and os.path.exists(src):
+                shutil.move(src, dst_dir)
+            if staging:
+                staging.release(staged)
+
+        compression = compression or DEFAULT_COMPRESSION
+        if deterministic:
+            compression = DEFAULT_COMPRESSION
+        result = c.compress(ext=compression["format"], queue=queue, deterministic=deterministic, dst_dir=dst_dir,
+                            level=compression["level"], threads=compression["threads"])
+        if queue:
+            result.add_done_callback(lambda future: finish(future.exception() is None and future.result()))
+        else:
+            finish(result)
+
+    def benchmark_compression(self, samples=10, max_slowdown=4, save=True):
+        """
+        "benchmark_compression" is a method that compresses a sample of the system's ROMs with zip and 7z
+        at several levels and thread counts and picks the one with the smallest archives among those no
+        more than max_slowdown times slower than the fastest.  The pick is saved as "compression" in the
+        system model and used by "build_rom_set"
+
+        Args:
+            samples: number of ROMs to sample from the system's ROM folder
+            max_slowdown: how many times slower than the fastest candidate the pick may be
+            save: Boolean, if true, writes the pick to the system model
+
+        Returns:
+            Dictionary of the picked format, level and threads, None if there were no ROMs to sample
+
+        Raises:
+            None
+        """
+        rom_dir = os.path.join(self.rom_path, self.system)
+        bench_dir = os.path.join(self.temp_path, "Benchmark", self.system)
+        sample_dir = os.path.join(bench_dir, "Samples")
+        if not os.path.isdir(sample_dir):
+            os.makedirs(sample_dir)
+
+        with os.scandir(rom_dir) as entries:
+            roms = sorted(entry.path for entry in entries if entry.is_file())
+        # Spread the sample across the alphabet
+        for rom in roms[::max(1, len(roms) // samples)][:samples]:
+            c = Compressor(rom)
+            names = [crc_info["compress_name"] for crc_info in c.get_crc(use_catalog=False, nested=False)]
+            c.extract_many(names, dst_dir=sample_dir)
+        sample_files = [os.path.join(root, fname) for root, dirs, files in os.walk(sample_dir) for fname in files]
+        if not sample_files:
+            msg = "No ROMs to benchmark in {}".format(rom_dir)
+            logger.info(msg)
+            shutil.rmtree(bench_dir)
+            return None
+
+        thread_counts = sorted(set([1, os.cpu_count() or 1]))
+        candidates = [{"format": "zip", "level": level, "threads": None} for level in (1, 6, 9)]
+        candidates += [{"format": "7z", "level": level, "threads": threads}
+                       for level in (1, 5, 9) for threads in thread_counts]
+
+        results = []
+        for candidate in candidates:
+            dst_dir = os.path.join(bench_dir, "{format}-{level}-{threads}".format(**candidate))
+            if not os.path.isdir(dst_dir):
+                os.makedirs(dst_dir)
+            size = 0
+            start = time.perf_counter()
+            for sample_file in sample_files:
+                c = Compressor(sample_file)
+                if c.compress(ext=candidate["format"], remove_source=False, dst_dir=dst_dir,
+                              level=candidate["level"], threads=candidate["threads"]):
+                    size += os.path.getsize(c.dst_file)
+                    os.remove(c.dst_file)
+                else:
+                    size = None
+                    break
+            if size is not None:
+                results.append((candidate, size, time.perf_counter() - start))
+                msg = "{format} level {level} threads {threads}: ".format(**candidate)
+                msg += "{} bytes in {:.2f}s".format(size, results[-1][2])
+                logger.info(msg)
+        shutil.rmtree(bench_dir)
+
+        if not results:
+            return None
+        fastest = min(seconds for candidate, size, seconds in results)
+        usable = [result for result in results if result[2] <= fastest * max_slowdown]
+        best = min(usable, key=lambda result: (result[1], result[2]))[0]
+        msg = "Best compression for {} is {format} level {level} threads {threads}".format(self.system, **best)
+        logger.info(msg)
+
+        self.compression = best
+        if save:
+            _save_compression(os.path.join(SYSTEMS_DIR, "{}.json".format(self.system)), best)
+        return best
 
-    def build_rom_set(self, source_set, rename=True, compress=True):
+    def build_rom_set(self, source_set, rename=True, compress=True, jobs=None, deterministic=False, dedup=False):
         """
         "build_rom_set" is a method that will use all of the helper methods to build a
         set of ROMs for the system from availble ROMS in the source set by matching the
-        CRC values
+        CRC values.  Matches are grouped by source archive so each archive is opened once and
+        compression runs on a bounded queue that is waited on before returning.  ROMs are extracted and
+        compressed in the staging folder while they fit its budget, only the archives go to the ROM folder.
+        The archive format and level come from the system model, see "benchmark_compression"
 
         Args:
             source_set: Path of ROMs to build from
             rename: Boolean, if true, renames the extension
             compress: Boolean, if true, compresses the file
+            jobs: number of workers used to scan the source set and compress, defaults to the number of CPUs
+            deterministic: Boolean, if true, writes TorrentZip style zips so rebuilds are byte identical
+            dedup: Boolean, if true, hard links the archives into the ROM store so archives holding the
+                   same files under the same names share one copy, see "RomStore.add"
 
         Returns:
             None
@@ -347,15 +1088,161 @@ class System(Paths):
         Raises:
             None
         """
-        roms = self._match_crcs(source_set)
-        src_file = {}
+        roms = self._match_crcs(source_set, jobs=jobs)
+        archives = {}
         for rom in roms:
-            src_file["db_name"] = rom["dst"]
-            src_file["src"] = rom["name"]
-            src_file["extract"] = rom["compress_name"]
-            self._copy_rom(src_file, rename, compress)
+            src_file = {"db_name": rom["dst"], "src": rom["name"], "extract": rom["compress_name"],
+                        "nested_path": rom.get("nested_path"), "size": rom.get("size")}
+            archives.setdefault(rom["name"], []).append(src_file)
+
+        msg = "Copying {} ROMs from {} source files".format(len(roms), len(archives))
+        logger.info(msg)
+        store = RomStore() if dedup else None
+        staging = StagingArea(self.system)
+        queue = CompressionQueue(max_workers=jobs or os.cpu_count() or 1)
+        for src, src_files in archives.items():
+            self._copy_roms(src, src_files, rename, compress, queue, deterministic, store, staging,
+                            self.compression)
+        queue.shutdown()
+
+    def _copy_disc(self, game, sources, compress=True):
+        """
+        "_copy_disc" is a method that gathers every file of a disc image into a folder named after the
+        game, named as in the Redump DAT, and optionally zips the folder
+
+        Args:
+            game: Dictionary of the Redump game with its tracks
+            sources: List of the available ROM dictionaries, one per track
+            compress: Boolean, if true, compresses the disc folder
+
+        Returns:
+            True when the disc was copied
+
+        Raises:
+            None
+        """
+        disc_dir = os.path.join(self.rom_path, self.system, game["name"])
+        created = not os.path.isdir(disc_dir)
+        zip_file = None
+        try:
+            if created:
+                os.makedirs(disc_dir)
+
+            # Tracks in the same archive are extracted together so it is opened once
+            extract = {}
+            for track, source in zip(game["tracks"], sources):
+                if "sheet" in source:
+                    # Loose disc image, the track path was resolved from its sheet when it was hashed
+                    shutil.copy(source["path"], os.path.join(disc_dir, track["name"]))
+                elif source.get("nested_path"):
+                    c = Compressor(source["name"])
+                    c.extract(source["compress_name"], dst_dir=disc_dir, nested_path=source["nested_path"])
+                    self._rename_track(disc_dir, source["compress_name"], track["name"])
+                else:
+                    extract.setdefault(source["name"], []).append((source["compress_name"], track["name"]))
+
+            for archive, names in extract.items():
+                c = Compressor(archive)
+                c.extract_many([compressed_name for compressed_name, track_name in names], dst_dir=disc_dir)
+                for compressed_name, track_name in names:
+                    self._rename_track(disc_dir, compressed_name, track_name)
+
+            if compress:
+                zip_file = disc_dir + ".zip"
+                c = Compressor(disc_dir)
+                c.compress_dir(dst_file=zip_file)
+        except OSError as e:
+            msg = "Could not copy {}: {}".format(game["name"], e)
+            logger.info(msg)
+            # A partial disc folder or zip would pass the next ROM audit
+            if created:
+                shutil.rmtree(disc_dir, ignore_errors=True)
+            if zip_file and os.path.isfile(zip_file):
+                os.remove(zip_file)
+            return False
+        return True
+
+    @staticmethod
+    def _rename_track(disc_dir, compressed_name, track_name):
+        """
+        "_rename_track" is a method that renames an extracted track to its name in the Redump DAT
+
+        Args:
+            disc_dir: Folder the track was extracted to
+            compressed_name: Name of the track in the archive
+            track_name: Name of the track in the DAT
+
+        Returns:
+            None
+
+        Raises:
+            FileExistsError if another file already has the DAT name
+        """
+        extracted = os.path.join(disc_dir, compressed_name)
+        if not os.path.exists(extracted):
+            extracted = os.path.join(disc_dir, os.path.basename(compressed_name))
+        dst = os.path.join(disc_dir, track_name)
+        if extracted != dst:
+            if os.path.exists(dst):
+                raise FileExistsError(dst)
+            os.rename(extracted, dst)
+
+    def build_disc_set(self, source_set=None, compress=True, jobs=None):
+        """
+        "build_disc_set" is a method that builds the disc images missing from the system by matching the
+        tracks listed in the system's Redump DAT against the hashed tracks in the source set.  A game is
+        only copied when every one of its tracks is available
+
+        Args:
+            source_set: Path of disc images to build from, defaults to the system's Redump folders
+            compress: Boolean, if true, compresses each disc into a zip
+            jobs: number of workers used to scan the source set, defaults to the number of CPUs
+
+        Returns:
+            list of the names of the games that were copied
+
+        Raises:
+            None
+        """
+        if source_set is None:
+            source_set = self.redump
+        games = Redump(self.system).read_database()
+        if not games:
+            return []
+
+        xml = os.path.join(self.rl_path, "RocketLauncherUI", "Databases", self.system, self.system + ".xml")
+        hs = Databases(self.system)
+        roms = hs.iter_audit(files_to_audit=os.path.join(self.rom_path, self.system), db=xml, audit_type="rom")
+        miss = set(rom["name"] for rom in roms if not rom["rom"])
+
+        by_sha1 = {}
+        by_crc = {}
+        for available_rom in self._filter_sets_by_crcs(source_set=source_set, jobs=jobs):
+            by_crc[available_rom["crc"]] = available_rom
+            if available_rom.get("sha1"):
+                by_sha1[available_rom["sha1"].lower()] = available_rom
+
+        copied = []
+        for game in games:
+            if game["name"] not in miss:
+                continue
+            sources = []
+            for track in game["tracks"]:
+                source = by_sha1.get((track.get("sha1") or "").lower()) or by_crc.get(track["crc"])
+                if source is None or not self._hashes_match(track, source):
+                    break
+                sources.append(source)
+            else:
+                msg = "Found all {} tracks of {}, copying to ROM folder".format(len(sources), game["name"])
+                logger.info(msg)
+                if self._copy_disc(game, sources, compress):
+                    copied.append(game["name"])
+
+        msg = "Copied {} of {} missing discs for {}".format(len(copied), len(miss), self.system)
+        logger.info(msg)
+        return copied
 
-    def fuzzy_match_set(self, source_set, assurance=.75, rename=True, compress=True):
+    def fuzzy_match_set(self, source_set, assurance=.75, rename=True, compress=True, jobs=None):
         """
         "fuzzy_match_set" is a method that will use all of the helper methods to build a
         set of ROMs for the system from available ROMS in the source set by matching the
@@ -366,6 +1253,7 @@ class System(Paths):
             assurance: Percent certainty of match
             rename: Boolean, if true, renames the extension
             compress: Boolean, if true, compresses the file
+            jobs: number of workers used to scan the source set, defaults to the number of CPUs
 
         Returns:
             matches:  Dictionary of matches that are less than 100%
@@ -373,12 +1261,12 @@ class System(Paths):
         Raises:
             None
         """
-        available_roms = self._filter_sets_by_crcs(source_set)
+        available_roms = self._filter_sets_by_crcs(source_set, jobs=jobs)
         xml = os.path.join(self.rl_path, "RocketLauncherUI", "Databases", self.system, self.system + ".xml")
         hs = Databases(self.system)
-        db = hs.audit(files_to_audit=os.path.join(self.rom_path, self.system), db=xml, audit_type="rom")
+        roms = hs.iter_audit(files_to_audit=os.path.join(self.rom_path, self.system), db=xml, audit_type="rom")
 
-        miss = [rom for rom in db if not rom["rom"]]
+        miss = [rom for rom in roms if not rom["rom"]]
         msg = "There are {} ROMs missing from {} database".format(len(miss), self.system)
         logger.info(msg)
 
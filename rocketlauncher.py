@@ -8,7 +8,7 @@ import xml.etree.cElementTree as ET
 import concurrent.futures
 
 from utilities import Databases, HyperList
-from general import Arcade, Compressor
+from general import Arcade, Compressor, XmlWriter
 from models.system import System
 
 TIME_STAMP = time.strftime(" %Y%m%d")
@@ -20,7 +20,7 @@ LOG_FORMAT = logging.Formatter("[{}] [%(levelname)s] [%(name)s] : %(message)s".f
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-file_handler = logging.FileHandler(LOG_FILE)
+file_handler = logging.FileHandler(LOG_FILE, delay=True)
 file_handler.setLevel(logging.DEBUG)
 file_handler.setFormatter(LOG_FORMAT)
 
@@ -309,28 +309,20 @@ class RocketLauncher(Databases, HyperList, System):
         xml = os.path.join(self.rl_ui_path, "Databases", "Systems.xml")
         try:
             shutil.copy(xml, "{}_backup_{}.xml".format(xml, TIME_STAMP))
-            root = ET.Element("systems")
-            for name in systems:
-                ET.SubElement(root, "system",
-                              name=name["name"],
-                              type=name["type"],
-                              year=name["year"],
-                              manufacturer=name["manufacturer"],
-                              enabled=name["enabled"])
         except FileNotFoundError:
             msg = "System Menu does not exist"
             logger.info(msg)
-            root = ET.Element("systems")
-            ET.SubElement(root, "system",
-                          name=self.full_sys["name"],
-                          type=self.full_sys["type"],
-                          year=self.full_sys["year"],
-                          manufacturer=self.full_sys["manufacturer"],
-                          enabled=self.full_sys["enabled"])
-
-        pretty = self.prettify(root)
-        with open(xml, mode="w") as xml:
-            xml.write(pretty)
+            systems = [self.full_sys]
+
+        with open(xml, mode="w") as xml, XmlWriter(xml) as writer:
+            writer.start("systems")
+            for name in systems:
+                writer.element("system", attrib={"name": name["name"],
+                                                 "type": name["type"],
+                                                 "year": name["year"],
+                                                 "manufacturer": name["manufacturer"],
+                                                 "enabled": name["enabled"]})
+            writer.end("systems")
 
     # Helper Methods
     def _extract_archive(self):
@@ -488,7 +480,7 @@ class RocketLauncher(Databases, HyperList, System):
         xml = os.path.join(self.rl_path, "RocketLauncherUI", "Databases", self.system, self.system + ".xml")
         src_path = os.path.join(self.emu_movies_path, self.emu_movies_name)
         hs = Databases(system=self.system)
-        header, db = hs.read_system_xml(db=xml)
+        names = set(game["name"] for game in hs.iter_system_xml(xml))
 
         media_paths = os.listdir(src_path)
 
@@ -513,10 +505,9 @@ class RocketLauncher(Databases, HyperList, System):
 
             final_files = []
 
-            for rom in db:
-                for file in files:
-                    if rom["name"] == os.path.basename(os.path.splitext(file)[0]):
-                        final_files.append(file)
+            for file in files:
+                if os.path.basename(os.path.splitext(file)[0]) in names:
+                    final_files.append(file)
 
             for file in final_files:
                 file = os.path.splitext(file)
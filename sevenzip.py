@@ -0,0 +1,533 @@
+import os
+import io
+import bz2
+import lzma
+import zlib
+import struct
+
+SIGNATURE = b"7z\xbc\xaf\x27\x1c"
+
+# Property IDs from the 7z format documentation (7zFormat.txt)
+K_END = 0x00
+K_HEADER = 0x01
+K_ARCHIVE_PROPERTIES = 0x02
+K_ADDITIONAL_STREAMS_INFO = 0x03
+K_MAIN_STREAMS_INFO = 0x04
+K_FILES_INFO = 0x05
+K_PACK_INFO = 0x06
+K_UNPACK_INFO = 0x07
+K_SUBSTREAMS_INFO = 0x08
+K_SIZE = 0x09
+K_CRC = 0x0A
+K_FOLDER = 0x0B
+K_CODERS_UNPACK_SIZE = 0x0C
+K_NUM_UNPACK_STREAM = 0x0D
+K_EMPTY_STREAM = 0x0E
+K_EMPTY_FILE = 0x0F
+K_NAME = 0x11
+K_WIN_ATTRIBUTES = 0x15
+K_ENCODED_HEADER = 0x17
+K_DUMMY = 0x19
+
+# Coder IDs
+COPY = b"\x00"
+LZMA = b"\x03\x01\x01"
+LZMA2 = b"\x21"
+DEFLATE = b"\x04\x01\x08"
+BZIP2 = b"\x04\x02\x02"
+
+FILE_ATTRIBUTE_DIRECTORY = 0x10
+
+
+class SevenZipError(Exception):
+    pass
+
+
+class _Buffer:
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def byte(self):
+        if self.pos >= len(self.data):
+            raise SevenZipError("Unexpected end of header")
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def read(self, length):
+        value = self.data[self.pos:self.pos + length]
+        if len(value) != length:
+            raise SevenZipError("Unexpected end of header")
+        self.pos += length
+        return value
+
+    def uint32(self):
+        return struct.unpack("<I", self.read(4))[0]
+
+    def number(self):
+        """7z variable length number, the leading 1 bits of the first byte give the extra bytes"""
+        first = self.byte()
+        mask = 0x80
+        value = 0
+        for i in range(8):
+            if first & mask == 0:
+                return value | ((first & (mask - 1)) << (8 * i))
+            value |= self.byte() << (8 * i)
+            mask >>= 1
+        return value
+
+    def bits(self, count):
+        result = []
+        mask = 0
+        value = 0
+        for _ in range(count):
+            if mask == 0:
+                value = self.byte()
+                mask = 0x80
+            result.append(bool(value & mask))
+            mask >>= 1
+        return result
+
+    def defined_bits(self, count):
+        if self.byte():
+            return [True] * count
+        return self.bits(count)
+
+    def digests(self, count):
+        defined = self.defined_bits(count)
+        return [self.uint32() if d else None for d in defined]
+
+
+class SevenZipArchive:
+
+    def __init__(self, fileobj):
+        self.fp = fileobj
+        self.pack_pos = 0
+        self.pack_sizes = []
+        self.folders = []
+        self.files = []
+        # The last solid block decoded, so reading its files in order decodes it once
+        self._decoded = None
+
+        self._read_signature_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        "close" drops the decoded solid block, the file object belongs to the caller and stays open
+
+        Args:
+            self
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self._decoded = None
+
+    # ----- Header parsing -----
+
+    def _read_signature_header(self):
+        self.fp.seek(0)
+        start = self.fp.read(32)
+        if len(start) != 32 or start[:6] != SIGNATURE:
+            raise SevenZipError("Not a 7z archive")
+        next_offset, next_size, next_crc = struct.unpack("<QQI", start[12:32])
+        if zlib.crc32(start[12:32]) != struct.unpack("<I", start[8:12])[0]:
+            raise SevenZipError("Start header CRC mismatch")
+        if next_size == 0:
+            return
+
+        self.fp.seek(32 + next_offset)
+        header = self.fp.read(next_size)
+        if zlib.crc32(header) != next_crc:
+            raise SevenZipError("Header CRC mismatch")
+
+        buf = _Buffer(header)
+        kind = buf.byte()
+        while kind == K_ENCODED_HEADER:
+            pack_pos, pack_sizes, folders = self._read_streams_info(buf)[:3]
+            data = self._decode_folder(folders[0], 32 + pack_pos, pack_sizes[:folders[0]["num_packed"]])
+            buf = _Buffer(data)
+            kind = buf.byte()
+        if kind != K_HEADER:
+            raise SevenZipError("Unknown header type {}".format(kind))
+        self._read_header(buf)
+
+    def _read_header(self, buf):
+        substreams = []
+        kind = buf.byte()
+        if kind == K_ARCHIVE_PROPERTIES:
+            while True:
+                prop = buf.byte()
+                if prop == K_END:
+                    break
+                buf.read(buf.number())
+            kind = buf.byte()
+        if kind == K_ADDITIONAL_STREAMS_INFO:
+            self._read_streams_info(buf)
+            kind = buf.byte()
+        if kind == K_MAIN_STREAMS_INFO:
+            self.pack_pos, self.pack_sizes, self.folders, substreams = self._read_streams_info(buf)
+            kind = buf.byte()
+        if kind == K_FILES_INFO:
+            self._read_files_info(buf, substreams)
+            kind = buf.byte()
+        if kind != K_END:
+            raise SevenZipError("Malformed header")
+
+    def _read_streams_info(self, buf):
+        pack_pos = 0
+        pack_sizes = []
+        folders = []
+        substreams = None
+        while True:
+            kind = buf.byte()
+            if kind == K_END:
+                break
+            elif kind == K_PACK_INFO:
+                pack_pos, pack_sizes = self._read_pack_info(buf)
+            elif kind == K_UNPACK_INFO:
+                folders = self._read_unpack_info(buf)
+            elif kind == K_SUBSTREAMS_INFO:
+                substreams = self._read_substreams_info(buf, folders)
+            else:
+                raise SevenZipError("Unknown streams property {}".format(kind))
+        if substreams is None:
+            substreams = [{"size": f["unpack_size"], "crc": f["crc"], "folder": i}
+                          for i, f in enumerate(folders)]
+        return pack_pos, pack_sizes, folders, substreams
+
+    @staticmethod
+    def _read_pack_info(buf):
+        pack_pos = buf.number()
+        count = buf.number()
+        sizes = [0] * count
+        while True:
+            kind = buf.byte()
+            if kind == K_END:
+                break
+            elif kind == K_SIZE:
+                sizes = [buf.number() for _ in range(count)]
+            elif kind == K_CRC:
+                buf.digests(count)
+            else:
+                raise SevenZipError("Unknown pack property {}".format(kind))
+        return pack_pos, sizes
+
+    def _read_unpack_info(self, buf):
+        if buf.byte() != K_FOLDER:
+            raise SevenZipError("Expected folder info")
+        count = buf.number()
+        if buf.byte():
+            raise SevenZipError("External folders are not supported")
+        folders = [self._read_folder(buf) for _ in range(count)]
+
+        if buf.byte() != K_CODERS_UNPACK_SIZE:
+            raise SevenZipError("Expected coder unpack sizes")
+        for folder in folders:
+            folder["unpack_sizes"] = [buf.number() for _ in range(folder["num_out"])]
+            bound = set(pair[1] for pair in folder["bind_pairs"])
+            main = [i for i in range(folder["num_out"]) if i not in bound][0]
+            folder["unpack_size"] = folder["unpack_sizes"][main]
+
+        while True:
+            kind = buf.byte()
+            if kind == K_END:
+                break
+            elif kind == K_CRC:
+                for folder, crc in zip(folders, buf.digests(count)):
+                    folder["crc"] = crc
+            else:
+                raise SevenZipError("Unknown unpack property {}".format(kind))
+        return folders
+
+    @staticmethod
+    def _read_folder(buf):
+        coders = []
+        num_in = 0
+        num_out = 0
+        for _ in range(buf.number()):
+            flag = buf.byte()
+            if flag & 0x80:
+                raise SevenZipError("Alternative coder methods are not supported")
+            coder = {"id": bytes(buf.read(flag & 0x0F)), "num_in": 1, "num_out": 1, "props": b""}
+            if flag & 0x10:
+                coder["num_in"] = buf.number()
+                coder["num_out"] = buf.number()
+            if flag & 0x20:
+                coder["props"] = bytes(buf.read(buf.number()))
+            num_in += coder["num_in"]
+            num_out += coder["num_out"]
+            coders.append(coder)
+
+        bind_pairs = [(buf.number(), buf.number()) for _ in range(num_out - 1)]
+        num_packed = num_in - len(bind_pairs)
+        if num_packed == 1:
+            bound = set(pair[0] for pair in bind_pairs)
+            packed = [i for i in range(num_in) if i not in bound]
+        else:
+            packed = [buf.number() for _ in range(num_packed)]
+        return {"coders": coders, "num_in": num_in, "num_out": num_out, "bind_pairs": bind_pairs,
+                "packed": packed, "num_packed": num_packed, "crc": None}
+
+    @staticmethod
+    def _read_substreams_info(buf, folders):
+        counts = [1] * len(folders)
+        kind = buf.byte()
+        if kind == K_NUM_UNPACK_STREAM:
+            counts = [buf.number() for _ in folders]
+            kind = buf.byte()
+
+        sizes = []
+        for folder, count in zip(folders, counts):
+            if count == 0:
+                continue
+            folder_sizes = []
+            if kind == K_SIZE:
+                folder_sizes = [buf.number() for _ in range(count - 1)]
+            folder_sizes.append(folder["unpack_size"] - sum(folder_sizes))
+            sizes.append(folder_sizes)
+        if kind == K_SIZE:
+            kind = buf.byte()
+
+        substreams = []
+        unknown = 0
+        for i, (folder, count) in enumerate(zip(folders, counts)):
+            for size in (sizes.pop(0) if count else []):
+                crc = folder["crc"] if count == 1 else None
+                if crc is None:
+                    unknown += 1
+                substreams.append({"size": size, "crc": crc, "folder": i})
+
+        while kind != K_END:
+            if kind == K_CRC:
+                digests = iter(buf.digests(unknown))
+                for stream in substreams:
+                    if stream["crc"] is None:
+                        stream["crc"] = next(digests)
+            else:
+                raise SevenZipError("Unknown substream property {}".format(kind))
+            kind = buf.byte()
+        return substreams
+
+    def _read_files_info(self, buf, substreams):
+        count = buf.number()
+        empty_stream = [False] * count
+        empty_file = []
+        names = [""] * count
+        attributes = [None] * count
+
+        while True:
+            kind = buf.byte()
+            if kind == K_END:
+                break
+            size = buf.number()
+            end = buf.pos + size
+            if kind == K_EMPTY_STREAM:
+                empty_stream = buf.bits(count)
+            elif kind == K_EMPTY_FILE:
+                empty_file = buf.bits(empty_stream.count(True))
+            elif kind == K_NAME:
+                if buf.byte():
+                    raise SevenZipError("External names are not supported")
+                names = bytes(buf.read(end - buf.pos)).decode("utf-16-le").split("\x00")[:count]
+            elif kind == K_WIN_ATTRIBUTES:
+                defined = buf.defined_bits(count)
+                buf.byte()  # External
+                attributes = [buf.uint32() if d else None for d in defined]
+            buf.pos = end
+
+        streams = iter(substreams)
+        empty_index = 0
+        index_in_folder = {}
+        for i in range(count):
+            info = {"name": names[i].replace("/", os.sep), "is_dir": False}
+            if empty_stream[i]:
+                is_file = empty_file[empty_index] if empty_index < len(empty_file) else False
+                empty_index += 1
+                info["is_dir"] = not is_file
+                info.update({"size": 0, "crc": 0, "folder": None, "index": None})
+            else:
+                stream = next(streams)
+                info.update({"size": stream["size"], "crc": stream["crc"], "folder": stream["folder"]})
+                info["index"] = index_in_folder.get(stream["folder"], 0)
+                index_in_folder[stream["folder"]] = info["index"] + 1
+            if attributes[i] is not None and attributes[i] & FILE_ATTRIBUTE_DIRECTORY:
+                info["is_dir"] = True
+            self.files.append(info)
+
+    # ----- Decoding -----
+
+    def _folder_offset(self, folder_index):
+        offset = 32 + self.pack_pos
+        stream = 0
+        for folder in self.folders[:folder_index]:
+            offset += sum(self.pack_sizes[stream:stream + folder["num_packed"]])
+            stream += folder["num_packed"]
+        return offset, self.pack_sizes[stream:stream + self.folders[folder_index]["num_packed"]]
+
+    def _decode_folder(self, folder, offset, pack_sizes):
+        if len(folder["coders"]) != 1 or len(pack_sizes) != 1:
+            raise SevenZipError("Only single coder folders can be decoded")
+        coder = folder["coders"][0]
+        self.fp.seek(offset)
+        packed = self.fp.read(pack_sizes[0])
+        size = folder["unpack_size"]
+
+        if coder["id"] == COPY:
+            data = packed
+        elif coder["id"] == LZMA:
+            props = coder["props"]
+            lc_lp_pb = props[0]
+            filters = [{"id": lzma.FILTER_LZMA1,
+                        "lc": lc_lp_pb % 9,
+                        "lp": (lc_lp_pb // 9) % 5,
+                        "pb": lc_lp_pb // 45,
+                        "dict_size": struct.unpack("<I", props[1:5])[0]}]
+            data = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=filters).decompress(packed, size)
+        elif coder["id"] == LZMA2:
+            prop = coder["props"][0]
+            dict_size = 0xFFFFFFFF if prop == 40 else (2 | (prop & 1)) << (prop // 2 + 11)
+            filters = [{"id": lzma.FILTER_LZMA2, "dict_size": dict_size}]
+            data = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=filters).decompress(packed, size)
+        elif coder["id"] == DEFLATE:
+            data = zlib.decompressobj(-15).decompress(packed, size)
+        elif coder["id"] == BZIP2:
+            data = bz2.decompress(packed)
+        else:
+            raise SevenZipError("Unsupported coder {}".format(coder["id"].hex()))
+
+        data = data[:size]
+        if len(data) != size:
+            raise SevenZipError("Decoded size mismatch")
+        if folder["crc"] is not None and zlib.crc32(data) != folder["crc"]:
+            raise SevenZipError("Folder CRC mismatch")
+        return data
+
+    # ----- Public Methods -----
+
+    def crc_info(self):
+        """
+        "crc_info" returns the CRC-32 info for every file in the archive, directories are skipped
+
+        Args:
+            self
+
+        Returns:
+            List of Dictionaries that have the filename, size and crc values
+
+        Raises:
+            None
+        """
+        return [{"compress_name": f["name"], "crc": "%08X" % (f["crc"] or 0), "size": f["size"]}
+                for f in self.files if not f["is_dir"]]
+
+    def _file_info(self, compressed_name):
+        for f in self.files:
+            if f["name"] == compressed_name and not f["is_dir"]:
+                return f
+        raise KeyError(compressed_name)
+
+    def unpack_size(self, compressed_name):
+        """
+        "unpack_size" returns the bytes decoded in memory to read a file, the size of the whole solid
+        block holding it
+
+        Args:
+            compressed_name(required): Name of file in archive
+
+        Returns:
+            size in bytes
+
+        Raises:
+            KeyError if the file is not in the archive
+        """
+        info = self._file_info(compressed_name)
+        if info["folder"] is None:
+            return 0
+        return self.folders[info["folder"]]["unpack_size"]
+
+    def read(self, compressed_name):
+        """
+        "read" decodes a single file from the archive into memory, the solid block holding the file
+        is decoded once and sliced, and kept until a file of another block is read
+
+        Args:
+            compressed_name(required): Name of file in archive
+
+        Returns:
+            bytes of the file
+
+        Raises:
+            KeyError if the file is not in the archive, SevenZipError if the coder is not supported
+        """
+        info = self._file_info(compressed_name)
+        if info["folder"] is None:
+            return b""
+
+        if self._decoded is None or self._decoded[0] != info["folder"]:
+            # Let go of the previous block before decoding the next
+            self._decoded = None
+            offset, pack_sizes = self._folder_offset(info["folder"])
+            self._decoded = (info["folder"], self._decode_folder(self.folders[info["folder"]], offset, pack_sizes))
+        data = self._decoded[1]
+        start = sum(f["size"] for f in self.files
+                    if f["folder"] == info["folder"] and f["index"] < info["index"])
+        member = data[start:start + info["size"]]
+        if info["crc"] is not None and zlib.crc32(member) != info["crc"]:
+            raise SevenZipError("CRC mismatch for {}".format(compressed_name))
+        return member
+
+
+def crc_info(src):
+    """
+    "crc_info" reads the headers of a 7z archive in process and returns its CRC-32 info
+
+    Args:
+        src(required): path of the archive or a seekable file object
+
+    Returns:
+        List of Dictionaries that have the filename, size and crc values
+
+    Raises:
+        SevenZipError if the archive can not be read natively
+    """
+    if isinstance(src, (bytes, bytearray)):
+        return SevenZipArchive(io.BytesIO(src)).crc_info()
+    if hasattr(src, "read"):
+        return SevenZipArchive(src).crc_info()
+    with open(src, "rb") as f:
+        return SevenZipArchive(f).crc_info()
+
+
+def crc_info_many(src_files):
+    """
+    "crc_info_many" reads the headers of several 7z archives in one call
+
+    Args:
+        src_files(required): list of archive paths
+
+    Returns:
+        Dictionary of archive path to its CRC-32 info, archives that can not be read natively map
+        to the SevenZipError raised for them
+
+    Raises:
+        None
+    """
+    results = {}
+    for src_file in src_files:
+        try:
+            results[src_file] = crc_info(src_file)
+        except (SevenZipError, OSError, lzma.LZMAError, zlib.error) as e:
+            results[src_file] = SevenZipError(str(e))
+    return results
@@ -2,16 +2,17 @@ import time
 import logging
 import os
 import shutil
+import threading
 import xml.etree.cElementTree as ET
 
-import xmltodict
-import requests
-from bs4 import BeautifulSoup
-
-from general import Arcade
+from general import Arcade, XmlWriter
 
 TIME_STAMP = time.strftime(" %Y%m%d")
 
+# Fields written for every game in a RocketLauncher/HyperSpin database, with the value used when missing
+GAME_XML_FIELDS = (("cloneof", ""), ("crc", ""), ("manufacturer", ""), ("year", ""), ("genre", ""),
+                   ("rating", ""), ("enabled", "enabled"))
+
 LOG_FILE = "arcade.log"
 LOG_STAMP = time.strftime("%Y-%m-%d %H:%M:%S")
 LOG_FORMAT = logging.Formatter("[{}] [%(levelname)s] [%(name)s] : %(message)s".format(LOG_STAMP))
@@ -19,7 +20,7 @@ LOG_FORMAT = logging.Formatter("[{}] [%(levelname)s] [%(name)s] : %(message)s".f
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-file_handler = logging.FileHandler(LOG_FILE)
+file_handler = logging.FileHandler(LOG_FILE, delay=True)
 file_handler.setLevel(logging.DEBUG)
 file_handler.setFormatter(LOG_FORMAT)
 
@@ -31,6 +32,189 @@ stream_handler.setFormatter(LOG_FORMAT)
 logger.addHandler(stream_handler)
 
 
+# Parsed databases and folder listings for the run, keyed by path and checked against the modified time
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _cached(kind, path, load):
+    """
+    "_cached" returns the value loaded for a path earlier in the run, or loads it when the path is new
+    or has been modified since
+
+    Args:
+        kind(required): name of the kind of value, so one path can hold several
+        path(required): path of the file or folder the value is read from
+        load(required): function that reads the value
+
+    Returns:
+        the value
+
+    Raises:
+        None
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return load()
+    key = (kind, os.path.abspath(path))
+    with _cache_lock:
+        hit = _cache.get(key)
+    if hit and hit[0] == mtime:
+        return hit[1]
+    value = load()
+    with _cache_lock:
+        _cache[key] = (mtime, value)
+    return value
+
+
+def clear_cache():
+    """
+    "clear_cache" forgets every database and folder listing read so far in the run
+
+    Args:
+        None
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    with _cache_lock:
+        _cache.clear()
+
+
+def _scan_stems(path):
+    with os.scandir(path) as entries:
+        return frozenset(os.path.splitext(entry.name)[0] for entry in entries)
+
+
+def list_stems(path):
+    """
+    "list_stems" returns the names of the files and folders in a folder without their extensions, read
+    once with os.scandir and cached for the run until the folder's modified time changes
+
+    Args:
+        path(required): folder to list
+
+    Returns:
+        frozenset of the names without extensions
+
+    Raises:
+        None
+    """
+    return _cached("stems", path, lambda: _scan_stems(path))
+
+
+def facet_games(games, facets=("genre",)):
+    """
+    "facet_games" groups games by the values of one or more fields in a single pass over the games
+
+    Args:
+        games(required): list of Game records or dictionaries
+        facets(optional, default = ("genre",)): fields to group by, e.g. ("genre", "year", "manufacturer")
+
+    Returns:
+        Dictionary of each facet to a Dictionary of its values to the list of games with that value, games
+        without a value are left out
+
+    Raises:
+        None
+    """
+    groups = dict((facet, {}) for facet in facets)
+    for game in games:
+        for facet in facets:
+            value = game.get(facet)
+            if value:
+                groups[facet].setdefault(value, []).append(game)
+    return groups
+
+
+class Game:
+    """
+    One game of a HyperSpin/RocketLauncher database.  Fields are attributes, and the record can also
+    be used like the dictionaries "read_system_xml" used to return: game["crc"], "genre" in game,
+    game.get("year") and dict(game) all work
+    """
+    FIELDS = ("name", "image", "index", "description", "cloneof", "crc", "manufacturer", "year", "genre",
+              "rating", "enabled")
+    AUDITS = ("rom", "artwork1", "artwork2", "artwork3", "artwork4", "wheel", "video", "theme")
+    __slots__ = FIELDS + AUDITS + ("extra", "tags")
+
+    def __init__(self, name=None, image=None, index=None):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        for audit in self.AUDITS:
+            setattr(self, audit, False)
+        self.name = name
+        self.image = image
+        self.index = index
+        self.extra = None
+        # Bit per field that was in the XML, even when empty
+        self.tags = 0
+
+    @classmethod
+    def from_element(cls, elem):
+        game = cls(elem.get("name"), elem.get("image"), elem.get("index"))
+        for dat in elem:
+            game[dat.tag] = dat.text
+        if game.crc:
+            game.crc = game.crc.zfill(8).upper()
+        return game
+
+    def copy(self):
+        game = Game.__new__(Game)
+        for slot in self.__slots__:
+            setattr(game, slot, getattr(self, slot))
+        if self.extra:
+            game.extra = dict(self.extra)
+        return game
+
+    def __getitem__(self, key):
+        if key in self.FIELDS or key in self.AUDITS:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+            self.tags |= 1 << self.FIELDS.index(key)
+        elif key in self.AUDITS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        if key in ("name", "image", "index") or key in self.AUDITS:
+            return True
+        if key in self.FIELDS:
+            return getattr(self, key) is not None or bool(self.tags & 1 << self.FIELDS.index(key))
+        return bool(self.extra) and key in self.extra
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return [key for key in self.FIELDS + self.AUDITS if key in self] + list(self.extra or ())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return "Game({!r})".format(self.name)
+
+
 class Databases(Arcade):
 
     def __init__(self, system):
@@ -39,62 +223,69 @@ class Databases(Arcade):
         self.system = system
         # self.db_path = os.path.join(self.hs_path, "Databases", self.system)
 
-    def read_system_xml(self, db="hyperspin"):
+    def _system_xml_path(self, db):
+        if db == "hyperspin":
+            return os.path.join(self.db_path, self.system + ".xml")
+        return db
+
+    def iter_system_xml(self, db="hyperspin", header=None):
         """
-        "read_system_xml" Method returns info in a dictionary from the
-        selected system's database
+        "iter_system_xml" Method streams the games of the selected system's database, each game
+        element is dropped once it is read so memory use does not grow with the size of the database
 
         Args:
             self
             db(required, default = HyperSpin) = name of XML to read
+            header(optional, default = None) = Dictionary to fill with the database header
 
         Returns:
-            List of Dictionaries for system header and system roms
+            generator of Game records
 
         Raises:
             None
         """
-        if db == "hyperspin":
-            xml = os.path.join(self.db_path, self.system + ".xml")
-        else:
-            xml = db
+        xml = self._system_xml_path(db)
 
         msg = "Extracting ROM info from {} . . .".format(self.system)
         logger.info(msg)
 
-        tree = ET.parse(xml)
-        doc = tree.getroot()
+        root = None
+        for event, elem in ET.iterparse(xml, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag == "header" and header is not None:
+                for dat in elem.iter():
+                    header[dat.tag] = dat.text
+            elif elem.tag == "game":
+                yield Game.from_element(elem)
+                # Drop the games already read from the tree
+                root.clear()
 
-        # Read Header
-        system = {}
-        for header in doc.iter("header"):
-            for dat in header.iter():
-                system[dat.tag] = dat.text
-        # Iterate thru the ROMs
-        rom = {}
-        roms = []
-        for game in doc.iter('game'):
-            rom['name'] = game.get('name')
-            rom['image'] = game.get('image')
-            rom['index'] = game.get('index')
-            rom['rom'] = False
-            rom['artwork1'] = False
-            rom['artwork2'] = False
-            rom['artwork3'] = False
-            rom['artwork4'] = False
-            rom['wheel'] = False
-            rom['video'] = False
-            rom['theme'] = False
-
-            for dat in game.iter():
-                rom[dat.tag] = dat.text
-            roms.append(dict(rom))
+    def read_system_xml(self, db="hyperspin"):
+        """
+        "read_system_xml" Method returns info in a dictionary from the
+        selected system's database
 
-        for rom in roms:
-            if rom["crc"]:
-                rom["crc"] = rom["crc"].zfill(8).upper()
+        Args:
+            self
+            db(required, default = HyperSpin) = name of XML to read
 
-        return system, roms
+        Returns:
+            List of Dictionaries for system header and system roms, the roms are Game records that
+            can be used like dictionaries.  A database is only parsed once per run, later calls get
+            copies until the file changes
+
+        Raises:
+            None
+        """
+        def parse():
+            header = {}
+            return header, tuple(self.iter_system_xml(db, header=header))
+
+        system, roms = _cached("system_xml", self._system_xml_path(db), parse)
+        return dict(system), [rom.copy() for rom in roms]
 
     def write_rom_xml(self, games, xml, list_name=None):
         """
@@ -114,59 +305,72 @@ class Databases(Arcade):
         """
         if not list_name:
             list_name = self.system
-        root = ET.Element("menu")
-        header = ET.SubElement(root, "header")
-        ET.SubElement(header, "list_name").text = list_name
-        ET.SubElement(header, "lastlistupdate").text = time.strftime("%Y%m%d")
-        ET.SubElement(header, "listversion").text = "Final"
-        ET.SubElement(header, "exporterversion").text = "Generated by retro-manager, Ben Elder"
-
-        for rom in games:
-            game = ET.SubElement(root, "game", name=rom["name"], index="", image="")
-            if "description" in rom:
-                ET.SubElement(game, "description").text = rom["description"]
-            else:
-                ET.SubElement(game, "description").text = rom["name"]
-            if "cloneof" in rom:
-                ET.SubElement(game, "cloneof").text = rom["cloneof"]
-            else:
-                ET.SubElement(game, "cloneof").text = ""
-            if "crc" in rom:
-                ET.SubElement(game, "crc").text = rom["crc"]
-            else:
-                ET.SubElement(game, "crc").text = ""
-            if "manufacturer" in rom:
-                ET.SubElement(game, "manufacturer").text = rom["manufacturer"]
-            else:
-                ET.SubElement(game, "manufacturer").text = ""
-            if "year" in rom:
-                ET.SubElement(game, "year").text = rom["year"]
-            else:
-                ET.SubElement(game, "year").text = ""
-            if "genre" in rom:
-                ET.SubElement(game, "genre").text = rom["genre"]
-            else:
-                ET.SubElement(game, "genre").text = ""
-            if "rating" in rom:
-                ET.SubElement(game, "rating").text = rom["rating"]
-            else:
-                ET.SubElement(game, "rating").text = ""
-            if "enabled" in rom:
-                ET.SubElement(game, "enabled").text = rom["enabled"]
-            else:
-                ET.SubElement(game, "enabled").text = "enabled"
-        pretty = self.prettify(root)
-        with open(xml, mode="w") as xml:
-            xml.write(pretty)
+        with open(xml, mode="w") as xml, XmlWriter(xml) as writer:
+            writer.start("menu")
+            writer.start("header")
+            writer.element("list_name", list_name)
+            writer.element("lastlistupdate", time.strftime("%Y%m%d"))
+            writer.element("listversion", "Final")
+            writer.element("exporterversion", "Generated by retro-manager, Ben Elder")
+            writer.end("header")
+
+            for rom in games:
+                writer.start("game", {"name": rom["name"], "index": "", "image": ""})
+                writer.element("description", rom["description"] if "description" in rom else rom["name"])
+                for field, default in GAME_XML_FIELDS:
+                    writer.element(field, rom[field] if field in rom else default)
+                writer.end("game")
+            writer.end("menu")
+
+    def iter_audit(self, files_to_audit, db, audit_type="rom"):
+        """
+        "iter_audit" Method audits folders against the database like "audit", streaming the games from
+        "iter_system_xml" so only the games the caller keeps stay in memory
+
+        Args:
+            files_to_audit(required):  directory path to the folder to audit, or a Dictionary of audit types
+                                       to folders to audit several types at once, e.g.
+                                       {"rom": roms_path, "wheel": wheel_path, "video": video_path}
+            db(required): path and name of XML database
+            audit_type(required, default = rom):  Type of Audit - ROM, Artwork, etc, used when
+                                                  files_to_audit is a single folder
+
+        Returns:
+            generator of Game records with the audit results - True/False
+
+        Raises:
+            None
+        """
+        if isinstance(files_to_audit, dict):
+            audits = {}
+            for each_type, folder in files_to_audit.items():
+                try:
+                    audits[each_type] = list_stems(folder)
+                except FileNotFoundError:
+                    msg = "{} does not exist, nothing found for the {} audit".format(folder, each_type)
+                    logger.debug(msg)
+                    audits[each_type] = frozenset()
+        else:
+            audits = {audit_type: list_stems(files_to_audit)}
+
+        for rom in self.iter_system_xml(db):
+            for each_type, have in audits.items():
+                if rom["name"] in have:
+                    rom[each_type] = True
+            yield rom
 
     def audit(self, files_to_audit, db, audit_type="rom"):
         """
-        "audit" Method audits folder and matches the type of to the database
+        "audit" Method audits folder and matches the type of to the database, a game is found when a file
+        or folder in the audited folder has its name, whatever the extension
 
         Args:
-            files_to_audit(required):  directory path to the folder to audit
+            files_to_audit(required):  directory path to the folder to audit, or a Dictionary of audit types
+                                       to folders to audit several types at once, e.g.
+                                       {"rom": roms_path, "wheel": wheel_path, "video": video_path}
             db(required): path and name of XML database
-            audit_type(required, default = rom):  Type of Audit - ROM, Artwork, etc
+            audit_type(required, default = rom):  Type of Audit - ROM, Artwork, etc, used when
+                                                  files_to_audit is a single folder
 
         Returns:
             Dictionary of ROM names with audit results - True/False
@@ -174,14 +378,7 @@ class Databases(Arcade):
         Raises:
             None
         """
-        system, roms = self.read_system_xml(db)
-        have = os.listdir(files_to_audit)
-        for fname in have:
-            for rom in roms:
-                if rom["name"] == os.path.splitext(fname)[0]:
-                    rom[audit_type] = True
-
-        return roms
+        return list(self.iter_audit(files_to_audit, db, audit_type))
 
 
 class HyperList(Arcade):
@@ -205,6 +402,8 @@ class HyperList(Arcade):
         Raises:
             None
         """
+        import requests
+        from bs4 import BeautifulSoup
         url = "http://hyperlist.hyperspin-fe.com/"
 
         hyper_list_html = os.path.join(self.temp_path, "hyperlist" + TIME_STAMP + ".html")
@@ -268,6 +467,7 @@ class HyperList(Arcade):
         Raises:
             None
         """
+        import requests
         if not os.path.exists(self.db_path):
             os.makedirs(self.db_path)
         db_path = os.path.join(self.db_path, self.system + ".xml")
@@ -342,6 +542,7 @@ class NoIntro(Arcade):
         Raises:
             None
         """
+        import xmltodict
         root_path = os.path.join(self.clrmamepro, "datfiles", "NoIntro")
         files = os.listdir(root_path)
         from models.system import System
@@ -428,6 +629,49 @@ class NoIntro(Arcade):
                     rom["region"] = rom_list[1]
         return roms
 
+    def read_digests(self, nointro_db):
+        """
+        "read_digests" Reads the MD5 and SHA1 of every single ROM game in a No Intro DAT, used to check
+        ROMs by more than their CRC-32
+
+        Args:
+            nointro_db(required): name of the No Intro database, as in the "NoIntro" ROM set of the system
+
+        Returns:
+            Dictionary of ROM names to Dictionaries of crc, md5 and sha1, empty if there is no DAT
+
+        Raises:
+            None
+        """
+        import xmltodict
+        root_path = os.path.join(self.clrmamepro, "datfiles", "NoIntro")
+        db = None
+        if os.path.isdir(root_path):
+            for fname in os.listdir(root_path):
+                if fname.split(" (")[0] == nointro_db:
+                    db = os.path.join(root_path, fname)
+        if not db:
+            msg = "No Intro database {} not found, matching {} by CRC only".format(nointro_db, self.system)
+            logger.info(msg)
+            return {}
+
+        with open(db, mode="r", encoding="UTF-8") as fd:
+            doc = xmltodict.parse(fd.read())
+
+        digests = {}
+        data = doc["datafile"]["game"]
+        if type(data) is not list:
+            data = [data]
+        for rom_info in data:
+            # Games with several ROM files have no single hash to compare
+            if type(rom_info.get("rom")) is not dict:
+                continue
+            rom = rom_info["rom"]
+            digests[rom_info["@name"]] = {"crc": rom["@crc"].zfill(8).upper(),
+                                          "md5": rom.get("@md5"),
+                                          "sha1": rom.get("@sha1")}
+        return digests
+
     def create_db_from_no_intro(self,
                                 roms="",
                                 regions=("World", "USA", "Europe"),
@@ -489,6 +733,65 @@ class NoIntro(Arcade):
         sys_db.write_rom_xml(final_roms, xml)
 
 
+class Redump(Arcade):
+
+    def __init__(self, system):
+        Arcade.__init__(self)
+        self.system = system
+
+    def read_database(self):
+        """
+        "read_database" Reads the Redump XML based database for the system and returns every game
+        with the hashes of its sheet and track files
+
+        Args:
+            self
+
+        Returns:
+            List of Dictionaries of game names with a list of tracks, empty if there is no DAT
+
+        Raises:
+            None
+        """
+        import xmltodict
+        root_path = os.path.join(self.clrmamepro, "datfiles", "Redump")
+        from models.system import System
+        platform = System(self.system)
+        db = None
+        if os.path.isdir(root_path):
+            for fname in os.listdir(root_path):
+                redump_name = fname.split(" - Datfile")[0].split(" (")[0]
+                if redump_name == getattr(platform, "redump_db", None):
+                    db = os.path.join(root_path, fname)
+                    msg = "Using the database found at {}".format(db)
+                    logger.info(msg)
+        if not db:
+            msg = "Redump database for {} not found in {}".format(self.system, root_path)
+            logger.info(msg)
+            return []
+
+        with open(db, mode="r", encoding="UTF-8") as fd:
+            doc = xmltodict.parse(fd.read())
+
+        games = []
+        data = doc["datafile"]["game"]
+        if type(data) is not list:
+            data = [data]
+        for game_info in data:
+            tracks = game_info["rom"]
+            if type(tracks) is not list:
+                tracks = [tracks]
+            game = {"name": game_info["@name"], "tracks": []}
+            for track in tracks:
+                game["tracks"].append({"name": track["@name"],
+                                       "size": int(track["@size"]),
+                                       "crc": track["@crc"].zfill(8).upper(),
+                                       "md5": track.get("@md5"),
+                                       "sha1": track.get("@sha1")})
+            games.append(game)
+        return games
+
+
 class EmuMovies(Arcade):
     def __init__(self, system):
         Arcade.__init__(self)
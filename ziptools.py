@@ -0,0 +1,375 @@
+import os
+import zlib
+import struct
+import zipfile
+import collections
+import concurrent.futures
+
+# Record layouts from the zip APPNOTE, they match the ones used by zipfile
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+END_OF_CENTRAL_DIR = struct.Struct("<4s4H2LH")
+ZIP64_END_OF_CENTRAL_DIR = struct.Struct("<4sQ2H2L4Q")
+ZIP64_LOCATOR = struct.Struct("<4sLQL")
+
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+CENTRAL_HEADER_SIGNATURE = b"PK\x01\x02"
+END_OF_CENTRAL_DIR_SIGNATURE = b"PK\x05\x06"
+ZIP64_END_OF_CENTRAL_DIR_SIGNATURE = b"PK\x06\x06"
+ZIP64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP64_EXTRA = 0x0001
+ZIP64_VERSION = 45
+DEFAULT_VERSION = 20
+UTF8_FLAG = 0x800
+
+DEFLATE_CHUNK_SIZE = 1024 * 1024
+DEFLATE_WINDOW = 32 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class ZipError(Exception):
+    pass
+
+
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def _encode_name(name):
+    try:
+        return name.encode("ascii"), 0
+    except UnicodeEncodeError:
+        return name.encode("utf-8"), UTF8_FLAG
+
+
+def _deflate_chunk(data, dictionary, level, last):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def deflate_parallel(fileobj, zinfo, threads=4, level=zlib.Z_DEFAULT_COMPRESSION, chunk_size=DEFLATE_CHUNK_SIZE):
+    """
+    "deflate_parallel" compresses a file into a single raw deflate stream pigz style, every chunk is
+    deflated on its own thread primed with the last 32K of the chunk before it, and the chunks are
+    joined with sync flushes so any inflater reads the result as one stream.  zlib releases the GIL
+    while it compresses so the threads run on separate cores
+
+    Args:
+        fileobj(required): file object opened for binary reading
+        zinfo(required): ZipInfo of the member, CRC and file_size are set once the file is read
+        threads(optional, default=4): Amount of chunks compressed at once
+        level(optional, default=zlib default): Compression level
+        chunk_size(optional, default=1MB): Size of the chunks given to each thread
+
+    Returns:
+        generator of the compressed bytes, in order
+
+    Raises:
+        None
+    """
+    crc = 0
+    file_size = 0
+    pending = collections.deque()
+    dictionary = b""
+    data = fileobj.read(chunk_size)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        while True:
+            next_data = fileobj.read(chunk_size)
+            last = not next_data
+            crc = zlib.crc32(data, crc)
+            file_size += len(data)
+            pending.append(pool.submit(_deflate_chunk, data, dictionary, level, last))
+            # Keep at most two chunks per thread in memory
+            while len(pending) > threads * 2 or (last and pending):
+                yield pending.popleft().result()
+            if last:
+                break
+            dictionary = data[-DEFLATE_WINDOW:]
+            data = next_data
+
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+
+
+def read_raw(src_file, zinfo):
+    """
+    "read_raw" reads the compressed bytes of a member straight out of a zip without inflating them
+
+    Args:
+        src_file(required): full path of the zip
+        zinfo(required): ZipInfo of the member from the zip's infolist
+
+    Returns:
+        generator of the compressed bytes
+
+    Raises:
+        ZipError: the local header of the member is damaged
+    """
+    with open(src_file, "rb") as fd:
+        fd.seek(zinfo.header_offset)
+        header = fd.read(LOCAL_HEADER.size)
+        if len(header) != LOCAL_HEADER.size or header[:4] != LOCAL_HEADER_SIGNATURE:
+            raise ZipError("Bad local header for {} in {}".format(zinfo.filename, src_file))
+        fields = LOCAL_HEADER.unpack(header)
+        fd.seek(fields[10] + fields[11], os.SEEK_CUR)
+        remaining = zinfo.compress_size
+        while remaining:
+            data = fd.read(min(COPY_CHUNK_SIZE, remaining))
+            if not data:
+                raise ZipError("{} in {} is truncated".format(zinfo.filename, src_file))
+            remaining -= len(data)
+            yield data
+
+
+def copy_info(zinfo, name=None):
+    """
+    "copy_info" makes a ZipInfo for writing a member raw under a new name, the data, CRC, sizes, time
+    and attributes are kept
+
+    Args:
+        zinfo(required): ZipInfo of the member from the source zip's infolist
+        name(optional, default=the current name): new name of the member
+
+    Returns:
+        ZipInfo
+
+    Raises:
+        ZipError: the member is encrypted, its data can not be moved without the key
+    """
+    if zinfo.flag_bits & 0x1:
+        raise ZipError("{} is encrypted".format(zinfo.filename))
+    new_info = zipfile.ZipInfo(name or zinfo.filename, zinfo.date_time)
+    new_info.compress_type = zinfo.compress_type
+    new_info.CRC = zinfo.CRC
+    new_info.compress_size = zinfo.compress_size
+    new_info.file_size = zinfo.file_size
+    new_info.create_system = zinfo.create_system
+    new_info.external_attr = zinfo.external_attr
+    return new_info
+
+
+class ZipWriter:
+    """
+    Writes zip archives from data that is already compressed, for the cases zipfile can not handle:
+    members deflated in parallel and members copied raw from another zip.  The archive layout is the
+    same as zipfile writes, local headers are patched once the sizes are known so no data descriptors
+    are needed.  The archive is written next to dst_file and only takes its name once it is complete
+    """
+
+    def __init__(self, dst_file):
+        self.dst_file = dst_file
+        self._tmp_file = dst_file + ".tmp"
+        self._fd = open(self._tmp_file, "wb")
+        self._members = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        """
+        "abort" closes and removes the unfinished archive, dst_file is left untouched
+
+        Args:
+            self
+
+        Returns:
+            None
+
+        Raises:
+            None
+        """
+        self._fd.close()
+        if os.path.exists(self._tmp_file):
+            os.remove(self._tmp_file)
+
+    def add(self, zinfo, chunks):
+        """
+        "add" writes a member to the archive
+
+        Args:
+            zinfo(required): ZipInfo with the name, date_time, compress_type and external_attr of the
+                member, CRC and file_size may be filled in while the chunks are read
+            chunks(required): iterable of the compressed bytes of the member
+
+        Returns:
+            None
+
+        Raises:
+            ZipError: the member is too large for a header without zip64 extensions
+        """
+        name, flags = _encode_name(zinfo.filename)
+        dos_time, dos_date = _dos_date_time(zinfo.date_time)
+        zip64 = max(zinfo.file_size, zinfo.compress_size) * 1.05 > ZIP64_LIMIT
+        extra = struct.pack("<2H2Q", ZIP64_EXTRA, 16, 0, 0) if zip64 else b""
+        version = ZIP64_VERSION if zip64 else DEFAULT_VERSION
+
+        zinfo.header_offset = self._fd.tell()
+        zinfo.flag_bits = flags
+        self._fd.write(LOCAL_HEADER.pack(LOCAL_HEADER_SIGNATURE, version, 0, flags, zinfo.compress_type,
+                                         dos_time, dos_date, 0, 0, 0, len(name), len(extra)))
+        self._fd.write(name)
+        self._fd.write(extra)
+
+        compress_size = 0
+        for data in chunks:
+            self._fd.write(data)
+            compress_size += len(data)
+        zinfo.compress_size = compress_size
+        end = self._fd.tell()
+
+        # Patch the CRC and sizes now that they are known
+        self._fd.seek(zinfo.header_offset + 14)
+        if zip64:
+            self._fd.write(struct.pack("<L2L", zinfo.CRC, 0xFFFFFFFF, 0xFFFFFFFF))
+            self._fd.seek(zinfo.header_offset + LOCAL_HEADER.size + len(name) + 4)
+            self._fd.write(struct.pack("<2Q", zinfo.file_size, zinfo.compress_size))
+        elif zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT:
+            raise ZipError("{} grew past the zip64 limit".format(zinfo.filename))
+        else:
+            self._fd.write(struct.pack("<3L", zinfo.CRC, zinfo.compress_size, zinfo.file_size))
+        self._fd.seek(end)
+
+        self._members.append(zinfo)
+
+    def close(self):
+        """
+        "close" writes the central directory, closes the archive and moves it to dst_file
+
+        Args:
+            self
+
+        Returns:
+            None
+
+        Raises:
+            OSError: the archive could not be finished, the unfinished archive is removed
+        """
+        try:
+            self._finish()
+        except BaseException:
+            self.abort()
+            raise
+        os.replace(self._tmp_file, self.dst_file)
+
+    def _finish(self):
+        start = self._fd.tell()
+        for zinfo in self._members:
+            name, flags = _encode_name(zinfo.filename)
+            dos_time, dos_date = _dos_date_time(zinfo.date_time)
+            zip64_fields = []
+            file_size = zinfo.file_size
+            compress_size = zinfo.compress_size
+            header_offset = zinfo.header_offset
+            if file_size > ZIP64_LIMIT:
+                zip64_fields.append(file_size)
+                file_size = 0xFFFFFFFF
+            if compress_size > ZIP64_LIMIT:
+                zip64_fields.append(compress_size)
+                compress_size = 0xFFFFFFFF
+            if header_offset > ZIP64_LIMIT:
+                zip64_fields.append(header_offset)
+                header_offset = 0xFFFFFFFF
+            extra = b""
+            version = DEFAULT_VERSION
+            if zip64_fields:
+                extra = struct.pack("<2H{}Q".format(len(zip64_fields)), ZIP64_EXTRA, 8 * len(zip64_fields),
+                                    *zip64_fields)
+                version = ZIP64_VERSION
+            self._fd.write(CENTRAL_HEADER.pack(CENTRAL_HEADER_SIGNATURE, version, zinfo.create_system, version, 0,
+                                               flags, zinfo.compress_type, dos_time, dos_date, zinfo.CRC,
+                                               compress_size, file_size, len(name), len(extra), 0, 0, 0,
+                                               zinfo.external_attr, header_offset))
+            self._fd.write(name)
+            self._fd.write(extra)
+
+        end = self._fd.tell()
+        count = len(self._members)
+        size = end - start
+        if count >= 0xFFFF or size > ZIP64_LIMIT or start > ZIP64_LIMIT:
+            self._fd.write(ZIP64_END_OF_CENTRAL_DIR.pack(ZIP64_END_OF_CENTRAL_DIR_SIGNATURE, 44, ZIP64_VERSION,
+                                                         ZIP64_VERSION, 0, 0, count, count, size, start))
+            self._fd.write(ZIP64_LOCATOR.pack(ZIP64_LOCATOR_SIGNATURE, 0, end, 1))
+        self._fd.write(END_OF_CENTRAL_DIR.pack(END_OF_CENTRAL_DIR_SIGNATURE, 0, 0, min(count, 0xFFFF),
+                                               min(count, 0xFFFF), min(size, 0xFFFFFFFF),
+                                               min(start, 0xFFFFFFFF), 0))
+        self._fd.close()
+
+
+def compress_parallel(src_file, dst_file, arcname=None, threads=4, level=zlib.Z_DEFAULT_COMPRESSION):
+    """
+    "compress_parallel" writes a standard single file deflate zip using "deflate_parallel"
+
+    Args:
+        src_file(required): full path of the file to compress
+        dst_file(required): full path of the zip to write
+        arcname(optional, default=file name of src_file): Name of the file in the zip
+        threads(optional, default=4): Amount of processor threads to use
+        level(optional, default=zlib default): Compression level
+
+    Returns:
+        None
+
+    Raises:
+        ZipError: the file could not be written
+    """
+    zinfo = zipfile.ZipInfo.from_file(src_file, arcname or os.path.basename(src_file))
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    with open(src_file, "rb") as fd, ZipWriter(dst_file) as zw:
+        zw.add(zinfo, deflate_parallel(fd, zinfo, threads=threads, level=level))
+
+
+def transplant(src_file, dst_file, members):
+    """
+    "transplant" writes a new zip with members of another zip, the compressed data and CRC of each
+    member are copied as raw bytes so nothing is inflated or deflated again
+
+    Args:
+        src_file(required): full path of the zip to read
+        dst_file(required): full path of the zip to write, must not be src_file
+        members(required): Dictionary of names in src_file to their names in dst_file, in the order
+                           to write them
+
+    Returns:
+        None
+
+    Raises:
+        ZipError: a member could not be copied
+        KeyError: a member is not in src_file
+    """
+    with zipfile.ZipFile(src_file) as zf:
+        infos = [zf.getinfo(name) for name in members]
+    with ZipWriter(dst_file) as zw:
+        for zinfo in infos:
+            zw.add(copy_info(zinfo, members[zinfo.filename]), read_raw(src_file, zinfo))
+
+
+def rename_members(src_file, dst_file, renames):
+    """
+    "rename_members" writes a copy of a zip with some of its members renamed, only the headers are
+    rewritten and the compressed data is copied as is
+
+    Args:
+        src_file(required): full path of the zip to read
+        dst_file(required): full path of the zip to write, must not be src_file
+        renames(required): Dictionary of current member names to new member names
+
+    Returns:
+        Number of members renamed
+
+    Raises:
+        ZipError: a member could not be copied
+    """
+    with zipfile.ZipFile(src_file) as zf:
+        names = zf.namelist()
+    members = dict((name, renames.get(name, name)) for name in names)
+    transplant(src_file, dst_file, members)
+    return sum(1 for name in names if members[name] != name)